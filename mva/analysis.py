@@ -17,6 +17,7 @@ from . import log; log = log[__name__]
 from . import norm_cache, CONST_PARAMS
 from . import samples
 from .samples import Higgs
+from .samples.db import set_read_workers
 from .categories import CATEGORIES
 from .classify import histogram_scores, Classifier
 from .defaults import (
@@ -44,6 +45,8 @@ def get_analysis(args, **kwargs):
             setattr(args, name, value)
         else:
             raise ValueError("invalid Analysis kwarg {0}".format(name))
+    if getattr(args, 'read_workers', None) is not None:
+        set_read_workers(args.read_workers)
     analysis = Analysis(
         year=year,
         systematics=args.systematics,
@@ -56,7 +59,8 @@ def get_analysis(args, **kwargs):
         random_mu=args.random_mu,
         mu=args.mu,
         ggf_weight=args.ggf_weight,
-        suffix=args.suffix)
+        suffix=args.suffix,
+        chunksize=getattr(args, 'chunksize', None))
     return analysis
 
 
@@ -77,7 +81,8 @@ class Analysis(object):
                  mu=1.,
                  ggf_weight=True,
                  suffix=None,
-                 norm_field=NORM_FIELD):
+                 norm_field=NORM_FIELD,
+                 chunksize=None):
         self.year = year
         self.systematics = systematics
         self.use_embedding = use_embedding
@@ -85,6 +90,8 @@ class Analysis(object):
         self.fakes_region = fakes_region
         self.suffix = suffix
         self.norm_field = norm_field
+        # read the events of the plotted samples in chunks of this many rows
+        self.chunksize = chunksize
 
         if use_embedding:
             log.info("Using embedded Ztautau")
@@ -395,7 +402,8 @@ class Analysis(object):
                 no_signal_fixes=no_signal_fixes,
                 bootstrap_data=bootstrap_data,
                 ravel=ravel,
-                uniform=uniform)
+                uniform=uniform,
+                chunksize=self.chunksize)
             histfactory_samples.append(field_sample)
 
         field_channels = {}
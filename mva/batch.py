@@ -0,0 +1,195 @@
+"""
+Structure-of-arrays container of events
+
+An EventBatch holds one array per field instead of a single structured array.
+Adding a field, selecting fields, selecting events and concatenating batches
+never copies the other fields: concatenations and event selections are only
+applied to a field when it is first accessed. Consumers that really need a
+structured array convert with to_records().
+"""
+import numpy as np
+
+from . import log; log = log[__name__]
+
+
+class LazyColumn(object):
+    """
+    A column computed on first access and then kept
+    """
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+        self.value = None
+
+    def __call__(self):
+        if self.value is None:
+            self.value = self.func(*self.args)
+            # release the inputs
+            self.args = None
+        return self.value
+
+
+def resolve(column):
+    if isinstance(column, LazyColumn):
+        return column()
+    return column
+
+
+def select_column(column, selection):
+    return resolve(column)[selection]
+
+
+def concatenate_column(batches, name):
+    return np.concatenate([batch[name] for batch in batches])
+
+
+class EventBatch(object):
+    """
+    Events stored as one array per field.
+
+    columns is a sequence of (name, array) pairs. Fields are accessed like
+    the fields of a structured array with batch['field'] and
+    batch[['field1', 'field2']]. Indexing with a boolean mask, an index
+    array or a slice selects events.
+    """
+    def __init__(self, columns=(), size=None):
+        self._names = []
+        self._columns = {}
+        self._size = size
+        for name, column in columns:
+            self[name] = column
+
+    @classmethod
+    def from_records(cls, rec):
+        """
+        Create a batch of views of the fields of a structured array
+        """
+        return cls([(name, rec[name]) for name in rec.dtype.names],
+                   size=len(rec))
+
+    @classmethod
+    def concatenate(cls, batches, fields=None):
+        """
+        Concatenate batches. The fields are only concatenated when accessed.
+        """
+        batches = list(batches)
+        if not batches:
+            return cls(size=0)
+        if fields is None:
+            fields = batches[0].names
+        if len(batches) == 1:
+            return batches[0][list(fields)]
+        size = sum(len(batch) for batch in batches)
+        return cls([(name, LazyColumn(concatenate_column, batches, name))
+                    for name in fields], size=size)
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    @property
+    def dtype(self):
+        return np.dtype([(name, self[name].dtype) for name in self._names])
+
+    @property
+    def shape(self):
+        return (len(self),)
+
+    def __len__(self):
+        if self._size is None:
+            return 0
+        return self._size
+
+    def __contains__(self, name):
+        return name in self._columns
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __repr__(self):
+        return "EventBatch({0:d} events: {1})".format(
+            len(self), ', '.join(self._names))
+
+    def column(self, name):
+        try:
+            column = self._columns[name]
+        except KeyError:
+            raise ValueError("field {0} not found in batch".format(name))
+        if isinstance(column, LazyColumn):
+            column = self._columns[name] = column()
+        return column
+
+    def __getitem__(self, key):
+        if isinstance(key, basestring):
+            return self.column(key)
+        if isinstance(key, (list, tuple)) and (
+                not key or isinstance(key[0], basestring)):
+            # select fields
+            for name in key:
+                if name not in self._columns:
+                    raise ValueError(
+                        "field {0} not found in batch".format(name))
+            return EventBatch([(name, self._columns[name]) for name in key],
+                              size=self._size)
+        # select events
+        if isinstance(key, slice):
+            size = len(xrange(*key.indices(len(self))))
+        else:
+            key = np.asarray(key)
+            if key.dtype == np.bool:
+                size = int(np.count_nonzero(key))
+            else:
+                size = len(key)
+        return EventBatch([
+            (name, LazyColumn(select_column, self._columns[name], key))
+            for name in self._names], size=size)
+
+    def __setitem__(self, name, column):
+        """
+        Add or replace a field without copying the other fields
+        """
+        if not isinstance(column, LazyColumn):
+            column = np.asarray(column)
+            if self._size is None:
+                self._size = len(column)
+            elif len(column) != self._size:
+                raise ValueError(
+                    "field {0} has {1:d} events but the batch has {2:d}".format(
+                        name, len(column), self._size))
+        if name not in self._columns:
+            self._names.append(name)
+        self._columns[name] = column
+
+    def __delitem__(self, name):
+        del self._columns[name]
+        self._names.remove(name)
+
+    def copy(self):
+        """
+        Shallow copy: the arrays of the fields are shared
+        """
+        return self[self._names]
+
+    def to_records(self, fields=None):
+        """
+        Return the fields as a structured (record) array
+        """
+        if fields is None:
+            fields = self._names
+        columns = [self[name] for name in fields]
+        rec = np.empty(len(self), dtype=[
+            (name, column.dtype) for name, column in zip(fields, columns)])
+        for name, column in zip(fields, columns):
+            rec[name] = column
+        return rec.view(np.recarray)
+
+    def to_array(self, fields=None, dtype=np.float64):
+        """
+        Return the fields as a 2D array with one column per field
+        """
+        if fields is None:
+            fields = self._names
+        arr = np.empty((len(self), len(fields)), dtype=dtype)
+        for i, name in enumerate(fields):
+            arr[:, i] = self[name]
+        return arr
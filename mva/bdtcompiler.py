@@ -0,0 +1,141 @@
+"""
+Compile a trained AdaBoost ensemble of decision trees into flat arrays
+
+The nodes of all trees are concatenated into single feature, threshold and
+children arrays and the contribution of every leaf to the decision function
+(SAMME.R class log-probability terms or SAMME estimator weights) is computed
+once. A batch of events is then evaluated by moving the events through all
+trees at once, one depth level per step, instead of calling each tree through
+sklearn.
+"""
+import numpy as np
+
+from sklearn.tree._tree import TREE_LEAF
+from sklearn.ensemble.weight_boosting import _samme_proba
+
+from . import log; log = log[__name__]
+
+# sklearn trees compare float32 features
+DTYPE = np.float32
+
+
+class LeafProba(object):
+    """
+    Stand-in estimator returning the class probabilities of tree leaves so
+    that the SAMME.R terms are computed with the same function as sklearn
+    """
+    def __init__(self, proba):
+        self.proba = proba
+
+    def predict_proba(self, X):
+        return self.proba.copy()
+
+
+def leaf_proba(tree, n_classes):
+    """
+    Class probabilities of each node of a fitted tree as in predict_proba
+    """
+    proba = np.array(tree.value[:, 0, :n_classes], dtype=np.float64)
+    normalizer = proba.sum(axis=1)[:, np.newaxis]
+    normalizer[normalizer == 0.0] = 1.0
+    return proba / normalizer
+
+
+def tree_depth(tree):
+    """
+    Depth of a fitted tree computed from its nodes. tree.max_depth may hold
+    the max_depth parameter instead of the depth reached for unbounded trees
+    depending on the sklearn version.
+    """
+    depth = 0
+    nodes = np.array([0], dtype=np.intp)
+    while True:
+        nodes = nodes[tree.children_left[nodes] != TREE_LEAF]
+        if len(nodes) == 0:
+            return depth
+        nodes = np.concatenate([tree.children_left[nodes],
+                                tree.children_right[nodes]])
+        depth += 1
+
+
+class CompiledBDT(object):
+    """
+    Flat array representation of a fitted binary AdaBoostClassifier of
+    decision trees. decision_function matches the decision_function of
+    the classifier.
+    """
+    def __init__(self, clf, batch_size=10000):
+        if clf.n_classes_ != 2:
+            raise ValueError("only binary classifiers can be compiled")
+        self.algorithm = clf.algorithm
+        self.batch_size = batch_size
+        n_classes = clf.n_classes_
+        estimators = list(clf.estimators_)
+        weights = clf.estimator_weights_[:len(estimators)]
+        self.norm = clf.estimator_weights_.sum()
+
+        features = []
+        thresholds = []
+        left = []
+        right = []
+        values = []
+        roots = []
+        depth = 0
+        offset = 0
+        for estimator, weight in zip(estimators, weights):
+            tree = estimator.tree_
+            is_leaf = tree.children_left == TREE_LEAF
+            proba = leaf_proba(tree, n_classes)
+            if self.algorithm == 'SAMME.R':
+                terms = _samme_proba(LeafProba(proba), n_classes, None)
+                # the first class counts negatively for binary classifiers
+                value = terms[:, 1] - terms[:, 0]
+            else:
+                # +weight or -weight depending on the predicted class
+                value = np.where(proba.argmax(axis=1) == 1, weight, -weight)
+            # leaves point to themselves
+            node_index = np.arange(tree.node_count) + offset
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold))
+            left.append(np.where(is_leaf, node_index,
+                                 tree.children_left + offset))
+            right.append(np.where(is_leaf, node_index,
+                                  tree.children_right + offset))
+            values.append(np.where(is_leaf, value, 0.))
+            roots.append(offset)
+            depth = max(depth, tree_depth(tree))
+            offset += tree.node_count
+
+        self.feature = np.concatenate(features).astype(np.intp)
+        self.threshold = np.concatenate(thresholds)
+        self.children_left = np.concatenate(left).astype(np.intp)
+        self.children_right = np.concatenate(right).astype(np.intp)
+        self.value = np.concatenate(values)
+        self.roots = np.array(roots, dtype=np.intp)
+        self.max_depth = depth
+        log.debug("compiled {0:d} trees with {1:d} nodes".format(
+            len(roots), offset))
+
+    def apply(self, X):
+        """
+        Return the leaf reached by each event (rows) in each tree (columns)
+        """
+        X = np.asarray(X, dtype=DTYPE)
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        node = np.empty((X.shape[0], len(self.roots)), dtype=np.intp)
+        node[:] = self.roots
+        for _ in xrange(self.max_depth):
+            go_left = X[rows, self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left,
+                            self.children_left[node],
+                            self.children_right[node])
+        return node
+
+    def decision_function(self, X):
+        X = np.asarray(X, dtype=DTYPE)
+        scores = np.empty(X.shape[0], dtype=np.float64)
+        for start in xrange(0, X.shape[0], self.batch_size):
+            stop = start + self.batch_size
+            leaves = self.apply(X[start:stop])
+            scores[start:stop] = self.value[leaves].sum(axis=1)
+        return scores / self.norm
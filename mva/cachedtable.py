@@ -1,21 +1,262 @@
 from . import log; log = log[__name__]
+from . import CACHE_DIR
+from .cutcompiler import compile_cut, evaluate
+import tables
 from tables import Table
 import numpy as np
 from functools import partial
+from collections import OrderedDict
+from tempfile import mkstemp
+import hashlib
+import atexit
+import threading
 import os
 
+SELECTION_CACHE_DIR = os.path.join(CACHE_DIR, 'selections')
+FINGERPRINTS = {}
+
+# PyTables is not thread-safe so the calls into PyTables are serialized
+HDF5_LOCK = threading.RLock()
+# pool of processes evaluating the selections (see set_selection_pool)
+SELECTION_POOL = None
+# files opened by a process of the selection pool
+WORKER_FILES = {}
+
 
 def nothing(f):
     return f
 
 
+def file_fingerprint(filename):
+    """
+    Identify a version of a file by its path, size and modification time
+    """
+    filename = os.path.abspath(filename)
+    if filename not in FINGERPRINTS:
+        stat = os.stat(filename)
+        FINGERPRINTS[filename] = (filename, stat.st_size, stat.st_mtime)
+    return FINGERPRINTS[filename]
+
+
+def normalize_condition(condition):
+    return ''.join(condition.split())
+
+
+def selection_cache_path(table, condition, start=None, stop=None, step=None):
+    key = repr((
+        file_fingerprint(table._v_file.filename),
+        table._v_pathname,
+        normalize_condition(condition),
+        start, stop, step))
+    return os.path.join(SELECTION_CACHE_DIR,
+                        hashlib.sha1(key).hexdigest() + '.npy')
+
+
+def set_selection_pool(pool):
+    """
+    Evaluate the in-kernel selections in the processes of a
+    multiprocessing pool instead of in this process. Each process opens its
+    own handle of the file containing the table so the selections of
+    several tables run concurrently. The pool is not closed here.
+    """
+    global SELECTION_POOL
+    SELECTION_POOL = pool
+
+
+def worker_where_coordinates(filename, pathname, condition,
+                             start=None, stop=None, step=None):
+    """
+    where_coordinates in a process of the selection pool
+    """
+    if filename not in WORKER_FILES:
+        WORKER_FILES[filename] = tables.open_file(filename, 'r')
+    table = WORKER_FILES[filename].get_node(pathname)
+    return Table.get_where_list(
+        table, condition, start=start, stop=stop, step=step)
+
+
+def where_coordinates(table, condition, start=None, stop=None, step=None):
+    pool = SELECTION_POOL
+    if pool is not None:
+        # the lock is not held while the selection runs elsewhere
+        return pool.apply(worker_where_coordinates, (
+            table._v_file.filename, table._v_pathname, condition,
+            start, stop, step))
+    with HDF5_LOCK:
+        return Table.get_where_list(
+            table, condition, start=start, stop=stop, step=step)
+
+
+def cached_where_coordinates(table, condition,
+                             start=None, stop=None, step=None):
+    """
+    Return the coordinates of the rows in the table passing the condition.
+
+    The coordinates are cached on disk and shared across processes. The cache
+    key includes the size and modification time of the file containing the
+    table so cached selections are not used once the ntuple is rebuilt.
+    Outdated selections are not removed automatically: clear them with
+    make clean-selections.
+    """
+    path = selection_cache_path(table, condition, start, stop, step)
+    if os.path.isfile(path):
+        log.debug("using cached selection {0}".format(path))
+        return np.load(path)
+    coords = where_coordinates(
+        table, condition, start=start, stop=stop, step=step)
+    if not os.path.isdir(SELECTION_CACHE_DIR):
+        try:
+            os.mkdir(SELECTION_CACHE_DIR)
+        except OSError:
+            # another process created it first
+            pass
+    # write to a temporary file and then rename it so that other processes
+    # never read a partially written selection
+    fd, tmp_path = mkstemp(dir=SELECTION_CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as tmp_file:
+        np.save(tmp_file, coords)
+    os.rename(tmp_path, path)
+    return coords
+
+
+if os.getenv('NOSELECTIONCACHE', None):
+    select_coordinates = where_coordinates
+    log.warning("selection cache is disabled")
+else:
+    select_coordinates = cached_where_coordinates
+
+
+def readonly_view(res):
+    if isinstance(res, tuple):
+        return tuple(readonly_view(r) for r in res)
+    view = res.view()
+    view.flags.writeable = False
+    return view
+
+
+def writeable(arr):
+    """
+    Copy-on-write for arrays that may be read-only views into the table cache.
+    Arrays that can already be written to are returned as is.
+    """
+    if arr.flags.writeable:
+        return arr
+    return arr.copy()
+
+
+def result_nbytes(res):
+    if isinstance(res, tuple):
+        return sum(r.nbytes for r in res)
+    return res.nbytes
+
+
+class TableCache(object):
+    """
+    Least recently used cache of table reads shared by all tables.
+
+    The total size of the cached arrays is kept below max_bytes by evicting
+    the least recently used entries. Results larger than the budget are
+    never cached. The cache can be used from several threads.
+    """
+    def __init__(self, max_bytes):
+        self.lock = threading.RLock()
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, key):
+        with self.lock:
+            try:
+                res, nbytes = self.entries.pop(key)
+            except KeyError:
+                self.misses += 1
+                raise
+            # move to the most recently used end
+            self.entries[key] = (res, nbytes)
+            self.hits += 1
+            return res
+
+    def __setitem__(self, key, res):
+        nbytes = result_nbytes(res)
+        with self.lock:
+            if key in self.entries:
+                self.nbytes -= self.entries.pop(key)[1]
+            if nbytes > self.max_bytes:
+                log.debug("table read of {0:d} bytes exceeds "
+                          "the cache size".format(nbytes))
+                return
+            self.entries[key] = (res, nbytes)
+            self.nbytes += nbytes
+            self.shrink()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def shrink(self):
+        with self.lock:
+            while self.nbytes > self.max_bytes:
+                _, (_, nbytes) = self.entries.popitem(last=False)
+                self.nbytes -= nbytes
+                self.evictions += 1
+
+    def set_max_bytes(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            self.shrink()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(self.entries),
+            'bytes': self.nbytes,
+            'max_bytes': self.max_bytes,
+        }
+
+
+# the cache size in MB can be set with the TABLE_CACHE_MB environment variable
+TABLE_CACHE = TableCache(
+    int(float(os.getenv('TABLE_CACHE_MB', 4096)) * 1024 ** 2))
+
+
+def cache_stats():
+    return TABLE_CACHE.stats()
+
+
+@atexit.register
+def log_cache_stats():
+    stats = TABLE_CACHE.stats()
+    if not (stats['hits'] or stats['misses']):
+        return
+    log.info(
+        "table cache: {hits:d} hits, {misses:d} misses, "
+        "{evictions:d} evictions, {entries:d} entries holding "
+        "{0:.1f} of {1:.1f} MB".format(
+            stats['bytes'] / 1024. ** 2,
+            stats['max_bytes'] / 1024. ** 2,
+            **stats))
+
+
 class memoize(object):
     """cache the return value of a method
 
     This class is meant to be used as a decorator of methods. The return value
-    from a given method invocation will be cached on the instance whose method
-    was invoked. All arguments passed to a method decorated with memoize must
-    be hashable.
+    from a given method invocation will be cached in TABLE_CACHE with a key
+    including the instance whose method was invoked. All arguments passed to a
+    method decorated with memoize must be hashable.
+
+    Read-only views of the cached arrays are returned so that cache hits do
+    not copy. Callers that need to modify the result must copy it first
+    (see writeable).
 
     If a memoized method is invoked directly on its class the result will not
     be cached. Instead the method will be invoked like a static method:
@@ -33,26 +274,78 @@ class memoize(object):
             return self.func
         return partial(self, obj)
     def __call__(self, *args, **kw):
-        obj = args[0]
+        key = (args[0], self.func, args[1:], frozenset(kw.items()))
         try:
-            cache = obj.__cache
-        except AttributeError:
-            cache = obj.__cache = {}
-        key = (self.func, args[1:], frozenset(kw.items()))
-        try:
-            res = cache[key]
+            res = TABLE_CACHE[key]
             log.debug("using cached table")
         except KeyError:
             log.debug("table not cached (first read)")
-            res = cache[key] = self.func(*args, **kw)
-        return np.copy(res)
+            res = TABLE_CACHE[key] = self.func(*args, **kw)
+        return readonly_view(res)
+
+
+class CachedMasks(object):
+    """
+    Masks of a CutEvaluator kept in TABLE_CACHE under a prefix identifying
+    the table and rows they were evaluated on. They are evicted with the
+    table reads so their memory is bounded by the cache size.
+    """
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __getitem__(self, key):
+        return TABLE_CACHE[(self.prefix, key)]
+
+    def __setitem__(self, key, mask):
+        TABLE_CACHE[(self.prefix, key)] = mask
+
+
+def cached_masks(prefix):
+    return CachedMasks(prefix)
+
+
+def uncached_masks(prefix):
+    return {}
 
 
 if os.getenv('NOCACHE', None):
     memoize_or_nothing = nothing
+    mask_cache = uncached_masks
     log.warning("table cache is disabled")
 else:
     memoize_or_nothing = memoize
+    mask_cache = cached_masks
+
+
+def read_refined(table, parent, condition=None, fields=None,
+                 start=None, stop=None, step=None, return_coords=False):
+    """
+    Read the rows passing both the parent and the condition.
+
+    The table only selects the rows passing the parent once and caches their
+    coordinates and columns (see selected_coordinates and selected_column).
+    The condition is then evaluated in memory on those rows so all
+    selections refining the same parent, such as all categories sharing the
+    preselection, cost a single scan of the table.
+    """
+    coords = table.selected_coordinates(parent, start, stop, step)
+    selection = None
+    if condition:
+        columns = dict(
+            (name, table.selected_column(parent, name, start, stop, step))
+            for name in compile_cut(condition).fields)
+        selection = evaluate(condition, columns, size=len(coords))
+        coords = coords[selection]
+    if fields is None:
+        fields = table.colnames
+    rec = np.empty(len(coords), dtype=[
+        (name, table.coldtypes[name]) for name in fields])
+    for name in fields:
+        column = table.selected_column(parent, name, start, stop, step)
+        rec[name] = column if selection is None else column[selection]
+    if return_coords:
+        return rec, coords
+    return rec
 
 
 class CachedTable(Table):
@@ -64,8 +357,110 @@ class CachedTable(Table):
 
     @memoize_or_nothing
     def readWhere(self, *args, **kwargs):
-        return Table.readWhere(self, *args, **kwargs)
+        with HDF5_LOCK:
+            return Table.readWhere(self, *args, **kwargs)
 
     @memoize_or_nothing
     def read_where(self, *args, **kwargs):
-        return Table.read_where(self, *args, **kwargs)
+        with HDF5_LOCK:
+            return Table.read_where(self, *args, **kwargs)
+
+    @memoize_or_nothing
+    def read_fields(self, condition=None, fields=None,
+                    start=None, stop=None, step=None,
+                    return_coords=False):
+        """
+        Read only the requested columns of the rows passing the condition.
+
+        The condition is evaluated in-kernel by PyTables so the columns it
+        references never need to be decoded here. Only the coordinates of
+        the selected rows are kept (see cached_where_coordinates) and each
+        requested column is then gathered on its own instead of decoding
+        every column of the full row. If fields is None then all columns
+        are read.
+
+        If return_coords is True then the coordinates of the selected rows
+        are also returned. They come from the same selection pass so this
+        does not require a second scan of the table.
+        """
+        if condition:
+            coords = select_coordinates(
+                self, condition, start=start, stop=stop, step=step)
+            read = partial(Table.read_coordinates, self, coords)
+        else:
+            coords = np.arange(
+                *slice(start, stop, step).indices(self.nrows))
+            read = partial(Table.read, self,
+                           start=start, stop=stop, step=step)
+        with HDF5_LOCK:
+            if fields is None:
+                rec = read()
+            else:
+                rec = np.empty(len(coords), dtype=[
+                    (name, self.coldtypes[name]) for name in fields])
+                if len(coords) > 0:
+                    for name in fields:
+                        rec[name] = read(field=name)
+        if return_coords:
+            return rec, coords
+        return rec
+
+    def fingerprint(self):
+        """
+        Identify this version of the table
+        """
+        return (file_fingerprint(self._v_file.filename), self._v_pathname)
+
+    @memoize_or_nothing
+    def selected_coordinates(self, condition, start=None, stop=None,
+                             step=None):
+        """
+        Coordinates of the rows passing the condition
+        """
+        return select_coordinates(
+            self, condition, start=start, stop=stop, step=step)
+
+    @memoize_or_nothing
+    def selected_column(self, condition, name, start=None, stop=None,
+                        step=None):
+        """
+        One column of the rows passing the condition
+        """
+        coords = self.selected_coordinates(condition, start, stop, step)
+        if len(coords) == 0:
+            return np.empty(0, dtype=self.coldtypes[name])
+        with HDF5_LOCK:
+            return Table.read_coordinates(self, coords, field=name)
+
+    def read_refined(self, parent, condition=None, fields=None,
+                     start=None, stop=None, step=None, return_coords=False):
+        return read_refined(self, parent, condition, fields=fields,
+                            start=start, stop=stop, step=step,
+                            return_coords=return_coords)
+
+    def iter_fields(self, condition=None, fields=None, chunksize=100000):
+        """
+        Iterate over windows of chunksize rows and yield the requested
+        columns of the rows passing the condition and their coordinates.
+        The chunks are not kept in the table or selection caches so the
+        memory used is bounded by the chunk size.
+        """
+        for start in xrange(0, self.nrows, chunksize):
+            stop = min(start + chunksize, self.nrows)
+            if condition:
+                coords = where_coordinates(self, condition,
+                                           start=start, stop=stop)
+                read = partial(Table.read_coordinates, self, coords)
+            else:
+                coords = np.arange(start, stop)
+                read = partial(Table.read, self, start=start, stop=stop)
+            with HDF5_LOCK:
+                if fields is None:
+                    rec = read()
+                else:
+                    rec = np.empty(len(coords), dtype=[
+                        (name, self.coldtypes[name]) for name in fields])
+                    if len(coords) > 0:
+                        for name in fields:
+                            rec[name] = read(field=name)
+            yield rec, coords
@@ -40,6 +40,17 @@ class Category(object):
             cuts &= cls.year_cuts[year]
         return cuts
 
+    @classmethod
+    def get_refinement_cuts(cls, year):
+        """
+        The cuts applied on top of common_cuts by this category so that
+        get_cuts(year) == common_cuts & get_refinement_cuts(year)
+        """
+        cuts = Cut(cls.cuts)
+        if hasattr(cls, 'year_cuts') and year in cls.year_cuts:
+            cuts &= cls.year_cuts[year]
+        return cuts
+
     @classmethod
     def get_parent(cls):
         if cls.is_control:
@@ -5,6 +5,7 @@ from operator import itemgetter
 import types
 import shutil
 from cStringIO import StringIO
+from multiprocessing import Pool, cpu_count
 
 # numpy imports
 import numpy as np
@@ -20,15 +21,20 @@ from sklearn.tree import DecisionTreeClassifier, export_graphviz
 from rootpy.extern.tabulartext import PrettyTable
 
 # root_numpy imports
-from root_numpy import rec2array, fill_hist
+from root_numpy import fill_hist
 
 # local imports
 from . import log; log = log[__name__]
 from . import MMC_MASS, MMC_PT
 from .plotting import plot_grid_scores
 from . import variables, CACHE_DIR, BDT_DIR
-from .systematics import systematic_name
-from .grid_search import BoostGridSearchCV
+from .systematics import systematic_name, weight_systematics_field
+from .batch import EventBatch
+from .bdtcompiler import CompiledBDT
+from .scorestore import ScoreStore, classifier_hash, USE_SCORE_STORE
+from .grid_search import (
+    BoostGridSearchCV, BoostHalvingSearchCV,
+    SharedArrays, shared_temp_folder)
 
 
 def print_feature_ranking(clf, fields):
@@ -168,22 +174,22 @@ def make_dataset(signals, backgrounds,
     background_weight_arrs = []
 
     for signal in signals:
-        rec = signal.merged_records(
+        rec = signal.merged_batch(
             category=category,
             region=region,
             fields=fields,
             cuts=cuts)
         signal_weight_arrs.append(rec['weight'])
-        signal_arrs.append(rec2array(rec, fields))
+        signal_arrs.append(rec.to_array(fields))
 
     for background in backgrounds:
-        rec = background.merged_records(
+        rec = background.merged_batch(
             category=category,
             region=region,
             fields=fields,
             cuts=cuts)
         background_weight_arrs.append(rec['weight'])
-        background_arrs.append(rec2array(rec, fields))
+        background_arrs.append(rec.to_array(fields))
 
     signal_array = np.concatenate(signal_arrs)
     signal_weight_array = np.concatenate(signal_weight_arrs)
@@ -209,12 +215,13 @@ def make_partitioned_dataset(signals, backgrounds,
             region=region,
             fields=fields,
             cuts=cuts,
-            key=partition_key)
+            key=partition_key,
+            as_batch=True)
         signal_weight_arrs.append(
             (left['weight'], right['weight']))
         signal_arrs.append(
-            (rec2array(left, fields),
-            rec2array(right, fields)))
+            (left.to_array(fields),
+            right.to_array(fields)))
 
     for background in backgrounds:
         left, right = background.partitioned_records(
@@ -222,12 +229,13 @@ def make_partitioned_dataset(signals, backgrounds,
             region=region,
             fields=fields,
             cuts=cuts,
-            key=partition_key)
+            key=partition_key,
+            as_batch=True)
         background_weight_arrs.append(
             (left['weight'], right['weight']))
         background_arrs.append(
-            (rec2array(left, fields),
-            rec2array(right, fields)))
+            (left.to_array(fields),
+            right.to_array(fields)))
 
     return (signal_arrs, signal_weight_arrs,
             background_arrs, background_weight_arrs)
@@ -316,6 +324,53 @@ def prepare_dataset(signal_train, signal_weight_train,
     return sample_train, labels_train, sample_weight_train
 
 
+def fit_shared(clf, data):
+    """
+    Fit clf on the SharedArrays data and return it
+    """
+    X, y, sample_weight = data.open()
+    clf.fit(X, y, sample_weight=sample_weight)
+    return clf
+
+
+class FinalFits(object):
+    """
+    Fit a clone of clf on each dataset (sample, labels, sample_weight).
+    With more than one job the fits run at the same time in separate
+    processes and start as soon as this object is created. Otherwise each
+    fit runs when its classifier is requested.
+    """
+    def __init__(self, clf, datasets, n_jobs=1):
+        if n_jobs < 0:
+            # same convention as joblib: -1 is all cores
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        self.data = [SharedArrays(*dataset, temp_folder=shared_temp_folder())
+                     for dataset in datasets]
+        self.clfs = [sklearn.clone(clf) for dataset in datasets]
+        self.pool = None
+        self.results = None
+        if n_jobs > 1:
+            self.pool = Pool(processes=min(n_jobs, len(datasets)))
+            self.results = [
+                self.pool.apply_async(fit_shared, (clf, data))
+                for clf, data in zip(self.clfs, self.data)]
+
+    def get(self, idx):
+        """
+        Return the fitted classifier of dataset idx
+        """
+        if self.results is not None:
+            return self.results[idx].get()
+        return fit_shared(self.clfs[idx], self.data[idx])
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        for data in self.data:
+            data.close()
+
+
 class Classifier(object):
     # minimal list of spectators
     SPECTATORS = [
@@ -371,6 +426,10 @@ class Classifier(object):
         # classifiers for the left and right partitions
         # each trained on the opposite partition
         self.clfs = None
+        # flat array versions of the classifiers used to compute the scores
+        self.compiled = None
+        # stored scores of these classifiers (see ScoreStore)
+        self.score_store = None
 
     def binning(self, year, overflow=None):
         # get the binning (see the optimize-binning script)
@@ -391,6 +450,7 @@ class Classifier(object):
         use_cache = True
         # attempt to load existing classifiers
         clfs = [None, None]
+        pickles = [None, None]
         for partition_idx in range(2):
 
             category_name = self.category.get_parent().name
@@ -404,7 +464,8 @@ class Classifier(object):
                 # use a previously trained classifier
                 log.info("found existing classifier in %s" % clf_filename)
                 with open(clf_filename, 'r') as f:
-                    clf = pickle.load(f)
+                    data = f.read()
+                clf = pickle.loads(data)
                 out = StringIO()
                 print >> out
                 print >> out
@@ -415,14 +476,18 @@ class Classifier(object):
                     # DANGER
                     log.warning("will apply classifiers on swapped partitions")
                     clfs[partition_idx] = clf
+                    pickles[partition_idx] = data
                 else:
                     clfs[(partition_idx + 1) % 2] = clf
+                    pickles[(partition_idx + 1) % 2] = data
             else:
                 log.warning("could not open %s" % clf_filename)
                 use_cache = False
                 break
         if use_cache:
             self.clfs = clfs
+            self.compile()
+            self.open_score_store(pickles)
             log.info("using previously trained classifiers")
             return True
         else:
@@ -447,12 +512,20 @@ class Classifier(object):
               min_fraction=0.001,
               min_fraction_steps=200,
               cv_nfold=10,
+              search='grid',
+              halving_factor=3,
               n_jobs=-1,
               dry_run=False):
         """
         Determine best BDTs on left and right partitions. Each BDT will then be
         used on the other partition.
+
+        If search is 'halving' then the leaf fractions are searched by
+        successive halving (see BoostHalvingSearchCV) instead of running the
+        full cross validation with max_trees for every leaf fraction.
         """
+        if search not in ('grid', 'halving'):
+            raise ValueError("search must be 'grid' or 'halving'")
         signal_arrs, signal_weight_arrs, \
         background_arrs, background_weight_arrs = make_partitioned_dataset(
             signals, backgrounds,
@@ -462,15 +535,14 @@ class Classifier(object):
             cuts=cuts,
             partition_key=self.partition_key)
 
-        if not dry_run:
-            self.clfs = [None, None]
-
+        clf_filenames = []
+        datasets = []
         for partition_idx in range(2):
 
-            clf_filename = os.path.join(BDT_DIR,
+            clf_filenames.append(os.path.join(BDT_DIR,
                 'clf_{0}_{1}{2}_{3}'.format(
                 self.category.name, self.mass,
-                self.clf_output_suffix, partition_idx))
+                self.clf_output_suffix, partition_idx)))
 
             signal_train, signal_weight_train, \
             background_train, background_weight_train = get_partition(
@@ -478,196 +550,293 @@ class Classifier(object):
                 background_arrs, background_weight_arrs,
                 partition_idx)
 
-            sample_train, labels_train, sample_weight_train = prepare_dataset(
+            datasets.append(prepare_dataset(
                 signal_train, signal_weight_train,
                 background_train, background_weight_train,
                 max_sig=max_sig,
                 max_bkg=max_bkg,
                 norm_sig_to_bkg=norm_sig_to_bkg,
                 same_size_sig_bkg=same_size_sig_bkg,
-                remove_negative_weights=remove_negative_weights)
-
-            if dry_run:
-                return
-
-            log.info("training a new classifier...")
-
-            if partition_idx == 0:
-
-                # grid search params
-                # min_samples_leaf
-                #min_leaf_high = int((sample_train.shape[0] / 8) *
-                #    (cv_nfold - 1.) / cv_nfold)
-                #min_leaf_low = max(10, int(min_leaf_high / 100.))
-                #min_leaf_step = max((min_leaf_high - min_leaf_low) / 100, 1)
-                #min_samples_leaf = range(
-                #    min_leaf_low, min_leaf_high, min_leaf_step)
-
-                # min_fraction_leaf
-                min_fraction_leaf = np.linspace(
-                    min_fraction, max_fraction, min_fraction_steps)
-
-                grid_params = {
-                    #'base_estimator__min_samples_leaf': min_samples_leaf,
-                    'base_estimator__min_fraction_leaf': min_fraction_leaf,
-                }
-
-                # create a BDT
-                clf = AdaBoostClassifier(
-                    DecisionTreeClassifier(),
-                    learning_rate=learning_rate,
-                    algorithm='SAMME.R',
-                    random_state=0)
-
-                # more efficient grid-search for boosting
-                grid_clf = BoostGridSearchCV(
-                    clf, grid_params,
-                    max_n_estimators=max_trees,
-                    min_n_estimators=min_trees,
-                    #score_func=accuracy_score,
-                    score_func=roc_auc_score, # area under the ROC curve
-                    cv=StratifiedKFold(labels_train, cv_nfold),
-                    n_jobs=n_jobs)
-
-                #grid_clf = GridSearchCV(
-                #    clf, grid_params,
-                #    score_func=accuracy_score,
-                #    cv = StratifiedKFold(labels_train, cv_nfold),
-                #    n_jobs=n_jobs)
-
-                log.info("")
-                log.info("using a %d-fold cross validation" % cv_nfold)
-                log.info("performing a grid search over these parameter values:")
-                for param, values in grid_params.items():
-                    log.info('{0} {1}'.format(param.split('__')[-1], values))
-                log.info("Minimum number of trees: %d" % min_trees)
-                log.info("Maximum number of trees: %d" % max_trees)
-                log.info("")
-                log.info("training new classifiers ...")
-
-                # perform the cross-validated grid-search
-                grid_clf.fit(
-                    sample_train, labels_train,
-                    sample_weight=sample_weight_train)
-
-                clf = grid_clf.best_estimator_
-                grid_scores = grid_clf.grid_scores_
-
-                log.info("Best score: %f" % grid_clf.best_score_)
-                log.info("Best Parameters:")
-                log.info(grid_clf.best_params_)
-
-                # plot a grid of the scores
-                plot_grid_scores(
-                    grid_scores,
-                    best_point={
-                        'base_estimator__min_fraction_leaf':
-                        clf.base_estimator.min_fraction_leaf,
-                        'n_estimators':
-                        clf.n_estimators},
-                    params={
-                        'base_estimator__min_fraction_leaf':
-                        'leaf fraction',
-                        'n_estimators':
-                        'trees'},
-                    name=(self.category.name +
-                          ("_{0}".format(self.mass)) +
-                          self.output_suffix +
-                          ("_{0}".format(partition_idx))))
-
-                # save grid scores
-                with open('{0}_grid_scores.pickle'.format(clf_filename), 'w') as f:
-                    pickle.dump(grid_scores, f)
-
-                # scale up the min-leaf and retrain on the whole set
-                #min_samples_leaf = clf.base_estimator.min_samples_leaf
-                #clf = sklearn.clone(clf)
-                #clf.base_estimator.min_samples_leaf = int(
-                #    min_samples_leaf *
-                #        cv_nfold / float(cv_nfold - 1))
-                #clf.fit(sample_train, labels_train,
-                #        sample_weight=sample_weight_train)
-                #log.info("After scaling up min_leaf")
-                #out = StringIO()
-                #print >> out
-                #print >> out
-                #print >> out, clf
-                #log.info(out.getvalue())
-
-            else: # training on the other partition
-                log.info("training a new classifier ...")
-
-                # use same params as in first partition
-                clf = sklearn.clone(clf)
+                remove_negative_weights=remove_negative_weights))
+
+        if dry_run:
+            return
+
+        self.clfs = [None, None]
+        pickles = [None, None]
+
+        # the parameters are determined on the first partition
+        sample_train, labels_train, sample_weight_train = datasets[0]
+
+        log.info("training a new classifier...")
+
+        # grid search params
+        # min_samples_leaf
+        #min_leaf_high = int((sample_train.shape[0] / 8) *
+        #    (cv_nfold - 1.) / cv_nfold)
+        #min_leaf_low = max(10, int(min_leaf_high / 100.))
+        #min_leaf_step = max((min_leaf_high - min_leaf_low) / 100, 1)
+        #min_samples_leaf = range(
+        #    min_leaf_low, min_leaf_high, min_leaf_step)
+
+        # min_fraction_leaf
+        min_fraction_leaf = np.linspace(
+            min_fraction, max_fraction, min_fraction_steps)
+
+        grid_params = {
+            #'base_estimator__min_samples_leaf': min_samples_leaf,
+            'base_estimator__min_fraction_leaf': min_fraction_leaf,
+        }
+
+        # create a BDT
+        clf = AdaBoostClassifier(
+            DecisionTreeClassifier(),
+            learning_rate=learning_rate,
+            algorithm='SAMME.R',
+            random_state=0)
+
+        # more efficient grid-search for boosting
+        search_kwargs = {}
+        if search == 'halving':
+            search_cls = BoostHalvingSearchCV
+            search_kwargs['factor'] = halving_factor
+        else:
+            search_cls = BoostGridSearchCV
+        # the best classifiers of both partitions are fitted below
+        grid_clf = search_cls(
+            clf, grid_params,
+            max_n_estimators=max_trees,
+            min_n_estimators=min_trees,
+            #score_func=accuracy_score,
+            score_func=roc_auc_score, # area under the ROC curve
+            cv=StratifiedKFold(labels_train, cv_nfold),
+            n_jobs=n_jobs,
+            refit=False,
+            **search_kwargs)
+
+        #grid_clf = GridSearchCV(
+        #    clf, grid_params,
+        #    score_func=accuracy_score,
+        #    cv = StratifiedKFold(labels_train, cv_nfold),
+        #    n_jobs=n_jobs)
+
+        log.info("")
+        log.info("using a %d-fold cross validation" % cv_nfold)
+        if search == 'halving':
+            log.info("searching by successive halving "
+                     "keeping 1/%d of the candidates at each round"
+                     % halving_factor)
+        log.info("performing a grid search over these parameter values:")
+        for param, values in grid_params.items():
+            log.info('{0} {1}'.format(param.split('__')[-1], values))
+        log.info("Minimum number of trees: %d" % min_trees)
+        log.info("Maximum number of trees: %d" % max_trees)
+        log.info("")
+        log.info("training new classifiers ...")
+
+        # perform the cross-validated grid-search
+        grid_clf.fit(
+            sample_train, labels_train,
+            sample_weight=sample_weight_train)
+
+        clf = sklearn.clone(clf).set_params(**grid_clf.best_params_)
+        grid_scores = grid_clf.grid_scores_
+
+        log.info("Best score: %f" % grid_clf.best_score_)
+        log.info("Best Parameters:")
+        log.info(grid_clf.best_params_)
+
+        # fit both partitions with the same params at the same time and
+        # export each classifier while the other one is still being fitted
+        fits = FinalFits(clf, datasets, n_jobs=n_jobs)
+        try:
+            # plot a grid of the scores
+            plot_grid_scores(
+                grid_scores,
+                best_point={
+                    'base_estimator__min_fraction_leaf':
+                    clf.base_estimator.min_fraction_leaf,
+                    'n_estimators':
+                    clf.n_estimators},
+                params={
+                    'base_estimator__min_fraction_leaf':
+                    'leaf fraction',
+                    'n_estimators':
+                    'trees'},
+                name=(self.category.name +
+                      ("_{0}".format(self.mass)) +
+                      self.output_suffix +
+                      ("_{0}".format(0))))
+
+            # save grid scores
+            with open('{0}_grid_scores.pickle'.format(
+                    clf_filenames[0]), 'w') as f:
+                pickle.dump(grid_scores, f)
+
+            # scale up the min-leaf and retrain on the whole set
+            #min_samples_leaf = clf.base_estimator.min_samples_leaf
+            #clf = sklearn.clone(clf)
+            #clf.base_estimator.min_samples_leaf = int(
+            #    min_samples_leaf *
+            #        cv_nfold / float(cv_nfold - 1))
+            #clf.fit(sample_train, labels_train,
+            #        sample_weight=sample_weight_train)
+            #log.info("After scaling up min_leaf")
+            #out = StringIO()
+            #print >> out
+            #print >> out
+            #print >> out, clf
+            #log.info(out.getvalue())
+
+            for partition_idx, clf_filename in enumerate(clf_filenames):
+
+                clf = fits.get(partition_idx)
                 out = StringIO()
                 print >> out
                 print >> out
                 print >> out, clf
                 log.info(out.getvalue())
 
-                clf.fit(sample_train, labels_train,
-                        sample_weight=sample_weight_train)
+                # export to graphviz dot format
+                if os.path.isdir(clf_filename):
+                    shutil.rmtree(clf_filename)
+                os.mkdir(clf_filename)
+                for itree, tree in enumerate(clf):
+                    export_graphviz(
+                        tree,
+                        out_file=os.path.join(
+                            clf_filename,
+                            'tree_{0:04d}.dot'.format(itree)),
+                        feature_names=self.all_fields)
+
+                data = pickle.dumps(clf)
+                with open('{0}.pickle'.format(clf_filename), 'w') as f:
+                    f.write(data)
 
-            # export to graphviz dot format
-            if os.path.isdir(clf_filename):
-                shutil.rmtree(clf_filename)
-            os.mkdir(clf_filename)
-            for itree, tree in enumerate(clf):
-                export_graphviz(
-                    tree,
-                    out_file=os.path.join(
-                        clf_filename,
-                        'tree_{0:04d}.dot'.format(itree)),
-                    feature_names=self.all_fields)
+                print_feature_ranking(clf, self.fields)
 
-            with open('{0}.pickle'.format(clf_filename), 'w') as f:
-                pickle.dump(clf, f)
+                self.clfs[(partition_idx + 1) % 2] = clf
+                pickles[(partition_idx + 1) % 2] = data
+        finally:
+            fits.close()
 
-            print_feature_ranking(clf, self.fields)
+        self.compile()
+        self.open_score_store(pickles)
 
-            self.clfs[(partition_idx + 1) % 2] = clf
+    def compile(self):
+        """
+        Compile the classifiers into flat arrays (see CompiledBDT)
+        """
+        self.compiled = [CompiledBDT(clf) for clf in self.clfs]
+
+    def open_score_store(self, pickles):
+        """
+        Use the stored scores of the classifiers pickled as pickles (in the
+        order of self.clfs)
+        """
+        if USE_SCORE_STORE:
+            self.score_store = ScoreStore(classifier_hash(pickles))
 
     def classify(self, sample, category, region,
-                 cuts=None, systematic='NOMINAL'):
+                 cuts=None, systematic='NOMINAL',
+                 weight_systematics=None):
+        """
+        Return the classifier scores and weights of the selected events.
 
+        If weight_systematics is a list of weight-only systematics then the
+        weights of each variation are also returned in a dict. They are
+        computed from the same read of the table and the scores are those of
+        the nominal events.
+        """
         if self.clfs == None:
             raise RuntimeError("you must train the classifiers first")
 
-        partitions = sample.partitioned_records(
+        kwargs = {}
+        if weight_systematics:
+            kwargs['weight_systematics'] = weight_systematics
+        else:
+            weight_systematics = []
+        weight_fields = ['weight'] + [
+            weight_systematics_field(sys) for sys in weight_systematics]
+
+        # tables of the datasets in the order they are read
+        tables = None
+        if self.score_store is not None:
+            tables = sample.score_tables(systematic)
+        if tables is not None:
+            # only read the weights if all scores are stored
+            recs = sample.records(
+                category=category,
+                region=region,
+                fields=[],
+                cuts=cuts,
+                systematic=systematic,
+                return_idx=True,
+                as_batch=True,
+                **kwargs)
+            if len(recs) != len(tables):
+                log.warning("not all tables of {0} could be read: "
+                            "ignoring the score store".format(sample.name))
+                tables = None
+            else:
+                stored = [self.score_store.get(table, idx)
+                          for table, (_, idx) in zip(tables, recs)]
+                if None not in stored:
+                    log.info("using stored scores")
+                    return self.classify_output(
+                        recs, stored, weight_fields, weight_systematics)
+
+        fields = list(self.fields)
+        if self.partition_key is not None and \
+                self.partition_key not in fields:
+            fields.append(self.partition_key)
+        recs = sample.records(
             category=category,
             region=region,
-            fields=self.fields,
+            fields=fields,
             cuts=cuts,
             systematic=systematic,
-            num_partitions=2,
             return_idx=True,
-            key=self.partition_key)
-
-        score_idx = [[], []]
-        for i, partition in enumerate(partitions):
-            for rec, idx in partition:
-                weight = rec['weight']
-                arr = rec2array(rec, self.fields)
-                # each classifier is never used on the partition that trained it
-                scores = self.clfs[i].decision_function(arr)
-                score_idx[i].append((idx, scores, weight))
-
-        # must preserve order of scores wrt the other fields!
-        # merge the scores and weights according to the idx
-        merged_scores = []
-        merged_weight = []
-        for left, right in zip(*score_idx):
-            left_idx, left_scores, left_weight = left
-            right_idx, right_scores, right_weight = right
-            insert_idx = np.searchsorted(left_idx, right_idx)
-            scores = np.insert(left_scores, insert_idx, right_scores)
-            weight = np.insert(left_weight, insert_idx, right_weight)
-            merged_scores.append(scores)
-            merged_weight.append(weight)
-
-        scores = np.concatenate(merged_scores)
-        weight = np.concatenate(merged_weight)
+            as_batch=True,
+            **kwargs)
+
+        if recs:
+            # all datasets at once: the events keep their order and each is
+            # scored by the classifier not trained on its partition
+            rec = EventBatch.concatenate([rec for rec, _ in recs])
+            idx = np.concatenate([idx for _, idx in recs])
+            scores = self.raw_scores(rec, idx)
+        else:
+            scores = np.empty(0, dtype=np.float64)
+        # split back into datasets
+        scores = np.split(scores, np.cumsum([len(idx) for _, idx in recs])[:-1])
+        if tables is not None:
+            for table, (_, idx), table_scores in zip(tables, recs, scores):
+                self.score_store.put(table, idx, table_scores)
+        return self.classify_output(
+            recs, scores, weight_fields, weight_systematics)
+
+    def classify_output(self, recs, scores, weight_fields,
+                        weight_systematics):
+        """
+        Concatenate the raw scores and the weights of each dataset as
+        returned by classify
+        """
+        if recs:
+            scores = self.transform_scores(np.concatenate(scores))
+            weights = [np.concatenate([np.array(rec[f], dtype=np.float64)
+                                       for rec, _ in recs])
+                       for f in weight_fields]
+        else:
+            scores = np.empty(0, dtype=np.float64)
+            weights = [np.empty(0, dtype=np.float64) for f in weight_fields]
+
+        if weight_systematics:
+            sys_weights = dict(zip(weight_systematics, weights[1:]))
+            return scores, weights[0], sys_weights
+        return scores, weights[0]
 
+    def transform_scores(self, scores):
         if self.transform:
             log.info("classifier scores are transformed")
             if isinstance(self.transform, types.FunctionType):
@@ -678,5 +847,33 @@ class Classifier(object):
                 scores = -1 + 2.0 / (1.0 +
                     np.exp(-self.clfs[0].n_estimators *
                             self.clfs[0].learning_rate * scores / 1.5))
+        return scores
 
-        return scores, weight
+    def score_batch(self, rec, idx):
+        """
+        Return the classifier scores of a batch of events read with their
+        table coordinates idx. Each event is scored by the classifier that
+        was not trained on the partition it belongs to, as in classify.
+        The batch must include the partition key field.
+        """
+        return self.transform_scores(self.raw_scores(rec, idx))
+
+    def raw_scores(self, rec, idx):
+        """
+        Scores of score_batch before the transformation
+        """
+        if self.clfs == None:
+            raise RuntimeError("you must train the classifiers first")
+        if self.partition_key is None:
+            partition = np.asarray(idx) % 2
+        else:
+            partition = np.abs(rec[self.partition_key]) % 2
+        arr = rec.to_array(self.fields)
+        scores = np.empty(len(arr), dtype=np.float64)
+        clfs = self.compiled if self.compiled is not None else self.clfs
+        for i, clf in enumerate(clfs):
+            in_partition = partition == i
+            if in_partition.any():
+                scores[in_partition] = clf.decision_function(
+                    arr[in_partition])
+        return scores
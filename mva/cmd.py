@@ -84,6 +84,9 @@ def analysis_parser(parser=None):
     parser.add_argument('--no-ggf-weight',
             dest='ggf_weight',
             action='store_false', default=True)
+    parser.add_argument('--read-workers', type=int, default=None,
+            help='read the datasets of each sample with this many threads '
+                 '(default: READ_WORKERS environment variable or 1)')
     return parser
 
 
@@ -136,6 +139,9 @@ def plotting_parser(parser=None):
                         help='do not display data on the plot')
     parser.add_argument('--show-ratio', action='store_true', default=False,
                         help='Draw plot with a ratio plot below the main plot')
+    parser.add_argument('--chunksize', type=int, default=None,
+                        help='read, score and fill the events in chunks of '
+                        'this many table rows to bound the memory used')
     return parser
 
 
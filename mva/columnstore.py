@@ -0,0 +1,222 @@
+"""
+Columnar ntuple store
+
+Each table is written into its own directory as one uncompressed .npy file
+per column along with a small JSON manifest holding the column dtypes, the
+number of rows and the cutflow of the table. The columns are memory-mapped
+when read so column access does not copy and concurrent processes share the
+same pages through the OS page cache.
+"""
+from . import log; log = log[__name__]
+from .cachedtable import (
+    memoize_or_nothing, mask_cache, read_refined, file_fingerprint)
+from .cutcompiler import CutEvaluator
+import numpy as np
+import json
+import os
+
+MANIFEST = 'manifest.json'
+
+
+def write_table(table, path, cutflow=None, chunksize=100000):
+    """
+    Write a PyTables table into a directory of per-column .npy files
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+    nrows = table.nrows
+    columns = {}
+    for name in table.colnames:
+        columns[name] = np.lib.format.open_memmap(
+            os.path.join(path, name + '.npy'), mode='w+',
+            dtype=table.coldtypes[name], shape=(nrows,))
+    for start in xrange(0, nrows, chunksize):
+        stop = min(start + chunksize, nrows)
+        chunk = table.read(start, stop)
+        for name, column in columns.items():
+            column[start:stop] = chunk[name]
+    for column in columns.values():
+        column.flush()
+    manifest = {
+        'name': table.name,
+        'rows': nrows,
+        'columns': dict((name, table.coldtypes[name].str)
+                        for name in table.colnames),
+        'cutflow': list(cutflow) if cutflow is not None else None,
+    }
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def write_column(path, name, column):
+    """
+    Add or replace a column of a table already in the store
+    """
+    manifest_path = os.path.join(path, MANIFEST)
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if len(column) != manifest['rows']:
+        raise ValueError(
+            "column {0} has {1:d} rows but table {2} has {3:d}".format(
+                name, len(column), manifest['name'], manifest['rows']))
+    np.save(os.path.join(path, name + '.npy'), column)
+    manifest['columns'][name] = column.dtype.str
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+
+def write_store(h5file, path, rfile=None, cutflow_suffix='_cutflow'):
+    """
+    Write all tables in an HDF5 file into a columnar store under path.
+    If a ROOT file is given then the cutflow histogram of each table is
+    stored in the table manifest.
+    """
+    for table in h5file.walk_nodes('/', 'Table'):
+        cutflow = None
+        if rfile is not None:
+            hist_name = table.name + cutflow_suffix
+            if hist_name in rfile:
+                hist = rfile[hist_name]
+                # include the underflow bin so that indices match ROOT bins
+                cutflow = [hist.GetBinContent(i)
+                           for i in xrange(hist.GetNbinsX() + 2)]
+            else:
+                log.warning("no cutflow found for {0}".format(table.name))
+        log.info("writing {0} ...".format(table.name))
+        write_table(table, os.path.join(path, table.name), cutflow=cutflow)
+
+
+class ColumnWindow(object):
+    """
+    Mapping of column names to a window of rows of a ColumnTable
+    """
+    def __init__(self, table, window):
+        self.table = table
+        self.window = window
+
+    def __getitem__(self, name):
+        return self.table.col(name)[self.window]
+
+
+class ColumnTable(object):
+    """
+    Table interface to a directory of memory-mapped columns.
+    Supports the subset of CachedTable used by the samples.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.name = self.manifest['name']
+        self.nrows = self.manifest['rows']
+        self.coldtypes = dict(
+            (str(name), np.dtype(str(dtype)))
+            for name, dtype in self.manifest['columns'].items())
+        self.colnames = sorted(self.coldtypes.keys())
+        self.cutflow = self.manifest['cutflow']
+        self._columns = {}
+
+    def __repr__(self):
+        return "ColumnTable('{0}')".format(self.path)
+
+    def col(self, name):
+        """
+        Return the memory-mapped column
+        """
+        try:
+            return self._columns[name]
+        except KeyError:
+            if name not in self.coldtypes:
+                raise KeyError(
+                    "column {0} not found in {1}".format(name, self.path))
+            column = self._columns[name] = np.load(
+                os.path.join(self.path, name + '.npy'), mmap_mode='r')
+            return column
+
+    def evaluator(self, start=None, stop=None, step=None):
+        """
+        Return a cut evaluator for a window of rows. The masks evaluated on
+        this window are kept in the table cache (see CachedMasks) so that
+        further selections sharing them do not scan the columns again.
+        """
+        window = slice(start, stop, step).indices(self.nrows)
+        return CutEvaluator(
+            ColumnWindow(self, slice(*window)),
+            size=len(xrange(*window)),
+            masks=mask_cache((self, window)))
+
+    def where_coordinates(self, condition, start=None, stop=None, step=None):
+        start, stop, step = slice(start, stop, step).indices(self.nrows)
+        selection = self.evaluator(start, stop, step)(condition)
+        return np.flatnonzero(selection) * step + start
+
+    def gather(self, coords, fields=None):
+        if fields is None:
+            fields = self.colnames
+        rec = np.empty(len(coords), dtype=[
+            (name, self.coldtypes[name]) for name in fields])
+        for name in fields:
+            rec[name] = self.col(name)[coords]
+        return rec
+
+    @memoize_or_nothing
+    def read_fields(self, condition=None, fields=None,
+                    start=None, stop=None, step=None,
+                    return_coords=False):
+        """
+        Gather the requested columns of the rows passing the condition.
+        Same interface as CachedTable.read_fields.
+        """
+        if condition:
+            coords = self.where_coordinates(condition, start, stop, step)
+        else:
+            coords = np.arange(*slice(start, stop, step).indices(self.nrows))
+        rec = self.gather(coords, fields)
+        if return_coords:
+            return rec, coords
+        return rec
+
+    def fingerprint(self):
+        """
+        Identify this version of the table
+        """
+        return (file_fingerprint(os.path.join(self.path, MANIFEST)),
+                self.name)
+
+    @memoize_or_nothing
+    def selected_coordinates(self, condition, start=None, stop=None,
+                             step=None):
+        return self.where_coordinates(condition, start, stop, step)
+
+    @memoize_or_nothing
+    def selected_column(self, condition, name, start=None, stop=None,
+                        step=None):
+        coords = self.selected_coordinates(condition, start, stop, step)
+        return self.col(name)[coords]
+
+    def read_refined(self, parent, condition=None, fields=None,
+                     start=None, stop=None, step=None, return_coords=False):
+        """
+        Same interface as CachedTable.read_refined
+        """
+        return read_refined(self, parent, condition, fields=fields,
+                            start=start, stop=stop, step=step,
+                            return_coords=return_coords)
+
+    def iter_fields(self, condition=None, fields=None, chunksize=100000):
+        """
+        Iterate over windows of chunksize rows and yield the requested
+        columns of the rows passing the condition and their coordinates.
+        The masks of each window are dropped once the window is read.
+        Same interface as CachedTable.iter_fields.
+        """
+        for start in xrange(0, self.nrows, chunksize):
+            stop = min(start + chunksize, self.nrows)
+            if condition:
+                evaluator = CutEvaluator(
+                    ColumnWindow(self, slice(start, stop)),
+                    size=stop - start)
+                coords = np.flatnonzero(evaluator(condition)) + start
+            else:
+                coords = np.arange(start, stop)
+            yield self.gather(coords, fields), coords
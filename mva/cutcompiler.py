@@ -0,0 +1,330 @@
+"""
+Compile rootpy Cut expressions into vectorized evaluators
+
+A cut is parsed once into an expression tree (the output of Cut.where() is
+valid Python syntax, as required by numexpr) and is then evaluated with numpy
+on any mapping of column names to arrays. A CutEvaluator keeps the boolean
+masks of the evaluated comparisons and logical sub-expressions keyed by their
+canonical form so that cuts sharing a sub-expression such as PRESELECTION or
+OS & P1P3 only compute it once for a given set of columns. Arithmetic
+intermediates are not kept.
+"""
+import ast
+import operator
+
+import numpy as np
+
+from . import log; log = log[__name__]
+
+BINARY_OPERATORS = {
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: np.true_divide,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+}
+
+UNARY_OPERATORS = {
+    ast.Invert: operator.invert,
+    ast.Not: np.logical_not,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+
+COMPARISONS = {
+    ast.Eq: operator.eq,
+    ast.NotEq: operator.ne,
+    ast.Lt: operator.lt,
+    ast.LtE: operator.le,
+    ast.Gt: operator.gt,
+    ast.GtE: operator.ge,
+}
+
+FUNCTIONS = {
+    'abs': np.abs,
+    'sqrt': np.sqrt,
+    'exp': np.exp,
+    'log': np.log,
+    'cos': np.cos,
+    'sin': np.sin,
+    'tan': np.tan,
+    'arccos': np.arccos,
+    'arcsin': np.arcsin,
+    'arctan': np.arctan,
+    'arctan2': np.arctan2,
+    'where': np.where,
+}
+
+# operators of the sub-expressions whose masks are kept
+LOGICAL_OPERATORS = frozenset([
+    operator.and_,
+    operator.or_,
+    operator.xor,
+    operator.invert,
+    np.logical_not,
+])
+
+CONSTANTS = {
+    'True': True,
+    'False': False,
+}
+
+COMPILED = {}
+
+
+class Node(object):
+    """
+    Base of the nodes of a compiled cut expression.
+    The key is the canonical form of the sub-expression. Subclasses define
+    evaluate(evaluator).
+    """
+    # only the masks of comparisons and logical operations are kept
+    cache = False
+
+    def __init__(self, key, children=(), fields=()):
+        self.key = key
+        self.children = children
+        self.fields = frozenset(fields).union(
+            *[child.fields for child in children])
+
+
+class Column(Node):
+
+    def __init__(self, name):
+        super(Column, self).__init__(name, fields=(name,))
+        self.name = name
+
+    def evaluate(self, evaluator):
+        return evaluator.column(self.name)
+
+
+class Constant(Node):
+
+    def __init__(self, value):
+        super(Constant, self).__init__(repr(value))
+        self.value = value
+
+    def evaluate(self, evaluator):
+        return self.value
+
+
+class BinaryOp(Node):
+
+    def __init__(self, op, left, right):
+        super(BinaryOp, self).__init__(
+            '({0} {1} {2})'.format(left.key, op.__name__, right.key),
+            children=(left, right))
+        self.op = op
+        self.cache = op in LOGICAL_OPERATORS
+
+    def evaluate(self, evaluator):
+        left, right = self.children
+        return self.op(evaluator.evaluate(left), evaluator.evaluate(right))
+
+
+class UnaryOp(Node):
+
+    def __init__(self, op, operand):
+        super(UnaryOp, self).__init__(
+            '({0} {1})'.format(op.__name__, operand.key),
+            children=(operand,))
+        self.op = op
+        self.cache = op in LOGICAL_OPERATORS
+
+    def evaluate(self, evaluator):
+        return self.op(evaluator.evaluate(self.children[0]))
+
+
+class Comparison(Node):
+    cache = True
+
+    def __init__(self, ops, operands):
+        key = operands[0].key
+        for op, operand in zip(ops, operands[1:]):
+            key += ' {0} {1}'.format(op.__name__, operand.key)
+        super(Comparison, self).__init__(
+            '({0})'.format(key), children=tuple(operands))
+        self.ops = ops
+
+    def evaluate(self, evaluator):
+        # chained comparisons such as 0.8 < dR < 2.4
+        values = [evaluator.evaluate(child) for child in self.children]
+        result = None
+        for op, left, right in zip(self.ops, values[:-1], values[1:]):
+            mask = op(left, right)
+            result = mask if result is None else result & mask
+        return result
+
+
+class Call(Node):
+
+    def __init__(self, name, args):
+        super(Call, self).__init__(
+            '{0}({1})'.format(name, ', '.join(arg.key for arg in args)),
+            children=tuple(args))
+        self.func = FUNCTIONS[name]
+
+    def evaluate(self, evaluator):
+        return self.func(*[evaluator.evaluate(arg) for arg in self.children])
+
+
+def build(node, expression):
+    """
+    Convert a Python AST node into a compiled expression node
+    """
+    if isinstance(node, ast.Expression):
+        return build(node.body, expression)
+    elif isinstance(node, ast.BinOp):
+        return BinaryOp(BINARY_OPERATORS[type(node.op)],
+                        build(node.left, expression),
+                        build(node.right, expression))
+    elif isinstance(node, ast.BoolOp):
+        # "and" and "or" are not valid in numexpr but treat them as & and |
+        op = operator.and_ if isinstance(node.op, ast.And) else operator.or_
+        result = build(node.values[0], expression)
+        for value in node.values[1:]:
+            result = BinaryOp(op, result, build(value, expression))
+        return result
+    elif isinstance(node, ast.UnaryOp):
+        return UnaryOp(UNARY_OPERATORS[type(node.op)],
+                       build(node.operand, expression))
+    elif isinstance(node, ast.Compare):
+        return Comparison([COMPARISONS[type(op)] for op in node.ops],
+                          [build(operand, expression) for operand in
+                           [node.left] + node.comparators])
+    elif isinstance(node, ast.Call):
+        if not isinstance(node.func, ast.Name) or node.func.id not in FUNCTIONS:
+            raise ValueError(
+                "unsupported function in cut: {0}".format(expression))
+        return Call(node.func.id, [build(arg, expression) for arg in node.args])
+    elif isinstance(node, ast.Name):
+        if node.id in CONSTANTS:
+            return Constant(CONSTANTS[node.id])
+        return Column(node.id)
+    elif isinstance(node, ast.Num):
+        return Constant(node.n)
+    raise ValueError("unsupported expression in cut: {0}".format(expression))
+
+
+class CompiledCut(object):
+    """
+    A cut expression parsed once into an expression tree
+    """
+    def __init__(self, expression):
+        self.expression = expression
+        if expression:
+            self.root = build(ast.parse(expression.strip(), mode='eval'),
+                              expression)
+            self.fields = self.root.fields
+        else:
+            # an empty cut selects everything
+            self.root = None
+            self.fields = frozenset()
+
+    def __repr__(self):
+        return "CompiledCut('{0}')".format(self.expression)
+
+    def __call__(self, columns, size=None):
+        """
+        Return the boolean mask of the cut evaluated on the columns
+        """
+        return CutEvaluator(columns, size=size)(self)
+
+
+def compile_cut(cut):
+    """
+    Compile a Cut or an expression string. Compiled cuts are cached by their
+    expression so each distinct cut is only parsed once.
+    """
+    if isinstance(cut, CompiledCut):
+        return cut
+    if cut is None:
+        expression = ''
+    elif isinstance(cut, basestring):
+        expression = cut
+    else:
+        expression = cut.where() if cut else ''
+    expression = expression.strip()
+    try:
+        return COMPILED[expression]
+    except KeyError:
+        compiled = COMPILED[expression] = CompiledCut(expression)
+        return compiled
+
+
+class CutEvaluator(object):
+    """
+    Evaluate cuts on a fixed set of columns.
+
+    columns may be any object supporting columns[name] such as a dict of
+    arrays or a record array. The boolean masks of the comparisons and
+    logical sub-expressions are kept in masks (a dict unless another mapping
+    such as a bounded cache is given) so evaluating further cuts sharing
+    those sub-expressions does not touch the columns again.
+    """
+    def __init__(self, columns, size=None, masks=None):
+        self.columns = columns
+        self.size = size
+        self.masks = {} if masks is None else masks
+
+    def column(self, name):
+        column = self.columns[name]
+        if self.size is None:
+            self.size = len(column)
+        return column
+
+    def evaluate(self, node):
+        if not node.cache:
+            return node.evaluate(self)
+        try:
+            return self.masks[node.key]
+        except KeyError:
+            result = node.evaluate(self)
+            # bitwise operations on integer columns are not masks
+            if isinstance(result, np.ndarray) and result.dtype == np.bool_:
+                # cached masks are shared by all cuts using them
+                result.flags.writeable = False
+                self.masks[node.key] = result
+            return result
+
+    def __call__(self, cut):
+        """
+        Return the boolean mask of the cut
+        """
+        cut = compile_cut(cut)
+        if cut.root is None:
+            if self.size is None:
+                raise ValueError(
+                    "the number of rows is required to evaluate an empty cut")
+            return np.ones(self.size, dtype=np.bool)
+        mask = self.evaluate(cut.root)
+        if np.isscalar(mask):
+            # the cut does not depend on any column
+            if self.size is None:
+                raise ValueError(
+                    "the number of rows is required to evaluate "
+                    "a constant cut")
+            return np.repeat(np.bool_(mask), self.size)
+        return mask
+
+    def select(self, cut):
+        """
+        Return the indices of the rows passing the cut
+        """
+        return np.flatnonzero(self(cut))
+
+    def clear(self):
+        self.masks.clear()
+
+
+def evaluate(cut, columns, size=None):
+    """
+    Return the boolean mask of a cut evaluated on the columns
+    """
+    return CutEvaluator(columns, size=size)(cut)
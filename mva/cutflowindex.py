@@ -0,0 +1,81 @@
+"""
+Cutflow index
+
+The event counts used to normalize the samples are bins of the <table>_cutflow
+histograms in hhskim.root. The index stores the bins of all cutflow histograms
+in a small JSON file next to hhskim.h5 (hhskim.cutflow.json) so the ROOT file
+does not need to be opened just to read them. The size and modification time
+of the ROOT file are recorded so a stale index is detected.
+"""
+from . import log; log = log[__name__]
+import json
+import os
+
+SUFFIX = '_cutflow'
+
+
+def index_path(ntuple_path, student):
+    return os.path.join(ntuple_path, student, student + '.cutflow.json')
+
+
+def source_stat(filename):
+    stat = os.stat(filename)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def read_cutflows(rfile, suffix=SUFFIX):
+    """
+    Return the bin contents, including the underflow bin so that indices
+    match ROOT bins, of all cutflow histograms in a ROOT file
+    """
+    cutflows = {}
+    for key in rfile.GetListOfKeys():
+        name = key.GetName()
+        if not name.endswith(suffix):
+            continue
+        hist = rfile.Get(name)
+        cutflows[name[:-len(suffix)]] = [
+            hist.GetBinContent(i) for i in xrange(hist.GetNbinsX() + 2)]
+    return cutflows
+
+
+def write_index(path, cutflows, source=None):
+    index = {
+        'source': source_stat(source) if source is not None else None,
+        'cutflows': cutflows,
+    }
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(index, f, indent=1, sort_keys=True)
+    os.rename(tmp_path, path)
+
+
+class CutflowIndex(object):
+
+    def __init__(self, cutflows, source=None):
+        self.cutflows = cutflows
+        self.source = source
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            index = json.load(f)
+        return cls(index['cutflows'], index.get('source'))
+
+    def is_stale(self, filename):
+        """
+        Return True if the index was not built from this version of the file
+        """
+        if self.source is None or not os.path.isfile(filename):
+            return False
+        return source_stat(filename) != self.source
+
+    def get(self, name, events_bin):
+        """
+        Return the content of a bin of the cutflow of a table or None if the
+        table is not in the index
+        """
+        try:
+            return self.cutflows[name][events_bin]
+        except (KeyError, IndexError):
+            return None
@@ -7,11 +7,17 @@ of an estimator.
 #         Gael Varoquaux <gael.varoquaux@normalesup.org>
 # License: BSD Style.
 
+import os
 import time
+import atexit
+import shutil
+import tempfile
 from copy import copy
+from collections import Sized
 import operator
 
 import numpy as np
+import scipy.sparse as sp
 
 from sklearn.base import BaseEstimator, is_classifier, clone
 from sklearn.cross_validation import check_cv, _safe_split
@@ -21,14 +27,83 @@ from sklearn.utils import safe_mask
 from sklearn.grid_search import GridSearchCV, ParameterGrid, _CVScoreTuple
 from sklearn.metrics.scorer import check_scoring
 
-__all__ = ['BoostGridSearchCV',]
+__all__ = ['BoostGridSearchCV', 'BoostHalvingSearchCV']
+
+# arrays already opened in this (worker) process
+_OPENED = {}
+# folders of the SharedArrays created by this process that are not closed
+_FOLDERS = {}
+
+
+def shared_temp_folder():
+    """
+    Where the arrays shared with the workers are written: JOBLIB_TEMP_FOLDER
+    if set (e.g. /dev/shm to keep them in memory) or the default temporary
+    directory
+    """
+    return os.environ.get('JOBLIB_TEMP_FOLDER', None)
+
+
+@atexit.register
+def remove_shared_folders():
+    """
+    Remove the arrays left behind if the search did not finish
+    """
+    for folder, pid in _FOLDERS.items():
+        if pid == os.getpid():
+            shutil.rmtree(folder, ignore_errors=True)
+    _FOLDERS.clear()
+
+
+class SharedArrays(object):
+    """
+    The training arrays written once to files that each worker opens as
+    read-only memory maps. Only the file names are pickled when a task is
+    dispatched so the cost of a task does not depend on the size of the
+    training sample. Sparse matrices cannot be memory-mapped and are
+    pickled with each task as before.
+    """
+    def __init__(self, X, y=None, sample_weight=None, temp_folder=None):
+        self.folder = tempfile.mkdtemp(prefix='boostgridsearch_',
+                                       dir=temp_folder)
+        _FOLDERS[self.folder] = os.getpid()
+        self.files = []
+        self.sparse = []
+        for name, arr in (('X', X), ('y', y),
+                          ('sample_weight', sample_weight)):
+            if arr is None or sp.issparse(arr):
+                self.files.append(None)
+                self.sparse.append(arr)
+                continue
+            path = os.path.join(self.folder, name + '.npy')
+            np.save(path, arr)
+            self.files.append(path)
+            self.sparse.append(None)
+
+    def open(self):
+        """
+        Return X, y and sample_weight as memory maps
+        """
+        if self.folder not in _OPENED:
+            _OPENED[self.folder] = tuple(
+                arr if path is None else np.load(path, mmap_mode='r')
+                for path, arr in zip(self.files, self.sparse))
+        return _OPENED[self.folder]
+
+    def close(self):
+        _OPENED.pop(self.folder, None)
+        _FOLDERS.pop(self.folder, None)
+        shutil.rmtree(self.folder, ignore_errors=True)
 
 
 def fit_grid_point(base_estimator, parameters,
-                   X, y, sample_weight,
-                   train, test, verbose,
+                   data, train, test, verbose,
                    **fit_params):
-    """Run fit on one set of parameters"""
+    """Run fit on one set of parameters
+
+    data is the SharedArrays of X, y and sample_weight
+    """
+    X, y, sample_weight = data.open()
     if verbose > 1:
         start_time = time.time()
         msg = '%s' % (', '.join('%s=%s' % (k, v)
@@ -63,13 +138,14 @@ def fit_grid_point(base_estimator, parameters,
 
 def score_each_boost(estimator, parameters,
                      min_n_estimators,
-                     X, y, sample_weight,
+                     data,
                      score_func, train, test,
                      verbose):
     """Run fit on one set of parameters
 
     Returns the score and the instance of the classifier
     """
+    X, y, sample_weight = data.open()
     if verbose > 1:
         start_time = time.time()
         msg = '%s' % (', '.join('%s=%s' % (k, v)
@@ -119,6 +195,26 @@ def score_each_boost(estimator, parameters,
     return all_scores, all_clf_params, n_test_samples
 
 
+def fit_and_score_each_boost(base_estimator, parameters,
+                             min_n_estimators,
+                             data,
+                             score_func, train, test,
+                             verbose, **fit_params):
+    """Run fit on one set of parameters and score each boost
+
+    The fitted ensemble is not returned, only the scores as in
+    score_each_boost
+    """
+    estimator, parameters, train, test = fit_grid_point(
+        base_estimator, parameters, data, train, test, verbose,
+        **fit_params)
+    return score_each_boost(estimator, parameters,
+                            min_n_estimators,
+                            data,
+                            score_func, train, test,
+                            verbose)
+
+
 class BoostGridSearchCV(GridSearchCV):
 
     def __init__(self, estimator, param_grid,
@@ -141,6 +237,78 @@ class BoostGridSearchCV(GridSearchCV):
             param_grid=param_grid,
             **kwargs)
 
+    def _score_candidates(self, base_estimator, data, candidates, folds,
+                          max_n_estimators):
+        """
+        Fit each candidate on each fold using max_n_estimators and return
+        for each candidate the list of scores (_CVScoreTuple) of each number
+        of estimators from min_n_estimators to max_n_estimators
+        """
+        # each task fits and then uses the fitted ensemble truncated to N
+        # estimators for N from 1 to n_estimators_max - 1 (inclusive)
+        # so the ensembles never leave the workers
+        out = Parallel(
+            n_jobs=self.n_jobs, verbose=self.verbose,
+            pre_dispatch=self.pre_dispatch
+        )(
+            delayed(fit_and_score_each_boost)(
+                base_estimator,
+                dict(clf_params, n_estimators=max_n_estimators),
+                self.min_n_estimators,
+                data,
+                self.score_func,
+                train, test,
+                self.verbose, **self.fit_params)
+            for clf_params in candidates
+            for train, test in folds)
+        # out is now a list of triplets for each candidate and fold:
+        # scores, estimator_params, n_test_samples of each stage
+
+        n_estimators_points = max_n_estimators - self.min_n_estimators + 1
+        n_folds = len(folds)
+
+        candidate_scores = list()
+        for block in range(0, len(out), n_folds):
+            scores = list()
+            for stage in range(n_estimators_points):
+                n_test_samples = 0
+                score = 0
+                all_scores = list()
+                for stage_scores, stage_params, stage_n_test_samples in \
+                        out[block:block + n_folds]:
+                    this_score = stage_scores[stage]
+                    this_n_test_samples = stage_n_test_samples[stage]
+                    parameters = stage_params[stage]
+                    all_scores.append(this_score)
+                    if self.iid:
+                        this_score *= this_n_test_samples
+                    score += this_score
+                    n_test_samples += this_n_test_samples
+                if self.iid:
+                    score /= float(n_test_samples)
+                else:
+                    score /= float(n_folds)
+                scores.append(_CVScoreTuple(
+                    parameters,
+                    score,
+                    np.array(all_scores)))
+            candidate_scores.append(scores)
+        return candidate_scores
+
+    def _search(self, base_estimator, data, candidates, folds):
+        """
+        Return the grid scores and the best of them
+        """
+        # fit at each grid point using the maximum n_estimators
+        grid_scores = reduce(operator.add, self._score_candidates(
+            base_estimator, data, candidates, folds,
+            self.max_n_estimators))
+        # Find the best parameters by comparing on the mean validation score:
+        # note that `sorted` is deterministic in the way it breaks ties
+        best = sorted(grid_scores, key=lambda x: x.mean_validation_score,
+                      reverse=True)[0]
+        return grid_scores, best
+
     def _fit(self, X, y, sample_weight, parameter_iterable):
         """Actual fitting, performing the search over parameters."""
 
@@ -172,77 +340,19 @@ class BoostGridSearchCV(GridSearchCV):
                                          n_candidates * len(cv)))
 
         base_estimator = clone(self.estimator)
+        candidates = list(ParameterGrid(self.param_grid))
 
-        # first fit at each grid point using the maximum n_estimators
-        param_grid = self.param_grid.copy()
-        param_grid['n_estimators'] = [self.max_n_estimators]
-        grid = ParameterGrid(param_grid)
-
-        pre_dispatch = self.pre_dispatch
-
-        clfs = Parallel(
-            n_jobs=self.n_jobs, verbose=self.verbose,
-            pre_dispatch=pre_dispatch
-        )(
-            delayed(fit_grid_point)(base_estimator, clf_params,
-                                    X, y, sample_weight,
-                                    train, test,
-                                    self.verbose, **self.fit_params)
-            for clf_params in grid
-            for train, test in cv)
-
-        # now use the already fitted ensembles but trancate to N estimators for
-        # N from 1 to n_estimators_max - 1 (inclusive)
-        out = Parallel(
-            n_jobs=self.n_jobs, verbose=self.verbose,
-            pre_dispatch=pre_dispatch
-        )(
-            delayed(score_each_boost)(clf, clf_params,
-                                      self.min_n_estimators,
-                                      X, y, sample_weight,
-                                      self.score_func,
-                                      train, test,
-                                      self.verbose)
-            for clf, clf_params, train, test in clfs)
-
-        out = reduce(operator.add, [zip(*stage) for stage in out])
-        # out is now a list of triplet: score, estimator_params, n_test_samples
-
-        n_estimators_points = self.max_n_estimators - self.min_n_estimators + 1
-        n_fits = len(out)
-        n_folds = len(cv)
-
-        grid_scores = list()
-        for block in range(0, n_fits, n_folds * n_estimators_points):
-            for grid_start in range(block, block + n_estimators_points):
-                n_test_samples = 0
-                score = 0
-                all_scores = list()
-                for this_score, parameters, this_n_test_samples in \
-                        out[grid_start:
-                            grid_start + n_folds * n_estimators_points:
-                            n_estimators_points]:
-                    all_scores.append(this_score)
-                    if self.iid:
-                        this_score *= this_n_test_samples
-                    score += this_score
-                    n_test_samples += this_n_test_samples
-                if self.iid:
-                    score /= float(n_test_samples)
-                else:
-                    score /= float(n_folds)
-                grid_scores.append(_CVScoreTuple(
-                    parameters,
-                    score,
-                    np.array(all_scores)))
+        # the tasks only receive the names of the files holding the arrays
+        data = SharedArrays(X, y, sample_weight,
+                            temp_folder=shared_temp_folder())
+        try:
+            grid_scores, best = self._search(
+                base_estimator, data, candidates, list(cv))
+        finally:
+            data.close()
 
         # Store the computed scores
         self.grid_scores_ = grid_scores
-
-        # Find the best parameters by comparing on the mean validation score:
-        # note that `sorted` is deterministic in the way it breaks ties
-        best = sorted(grid_scores, key=lambda x: x.mean_validation_score,
-                      reverse=True)[0]
         self.best_params_ = best.parameters
         self.best_score_ = best.mean_validation_score
 
@@ -261,3 +371,98 @@ class BoostGridSearchCV(GridSearchCV):
                 best_estimator.fit(X, **fit_params)
             self.best_estimator_ = best_estimator
         return self
+
+
+class BoostHalvingSearchCV(BoostGridSearchCV):
+    """
+    Successive halving over the parameter grid. All candidates are first
+    scored on min_n_folds folds with max_n_estimators / factor ** n_rounds
+    estimators. Only the best 1 / factor of the candidates are kept at each
+    round and re-evaluated with more folds and estimators until a single
+    candidate remains. It is finally scored on all folds with
+    max_n_estimators.
+
+    grid_scores_ has the same layout as in BoostGridSearchCV. Candidates that
+    were dropped keep the scores of the last round they were evaluated in,
+    with the last score repeated for the numbers of estimators beyond that
+    round (as for boosting that stopped early).
+    """
+    def __init__(self, estimator, param_grid,
+            max_n_estimators,
+            min_n_estimators=1,
+            factor=3,
+            min_n_folds=2,
+            **kwargs):
+
+        if factor < 2:
+            raise ValueError('factor must be 2 or greater')
+        if min_n_folds < 1:
+            raise ValueError('min_n_folds must be 1 or greater')
+        self.factor = factor
+        self.min_n_folds = min_n_folds
+        super(BoostHalvingSearchCV, self).__init__(
+            estimator=estimator,
+            param_grid=param_grid,
+            max_n_estimators=max_n_estimators,
+            min_n_estimators=min_n_estimators,
+            **kwargs)
+
+    def _search(self, base_estimator, data, candidates, folds):
+        # the number of rounds until a single candidate remains
+        n_rounds = 0
+        n_candidates = len(candidates)
+        while n_candidates > 1:
+            n_candidates = max(1, n_candidates // self.factor)
+            n_rounds += 1
+
+        min_n_folds = min(self.min_n_folds, len(folds))
+        remaining = range(len(candidates))
+        candidate_scores = [None] * len(candidates)
+        for round_idx in range(n_rounds + 1):
+            if n_rounds > 0:
+                n_folds = min_n_folds + int(round(
+                    (len(folds) - min_n_folds) * round_idx /
+                    float(n_rounds)))
+            else:
+                n_folds = len(folds)
+            n_estimators = max(self.min_n_estimators, int(round(
+                self.max_n_estimators *
+                self.factor ** float(round_idx - n_rounds))))
+            if self.verbose > 0:
+                print "[BoostHalvingSearchCV] round %d: %d candidates, " \
+                      "%d folds, %d estimators" % (
+                          round_idx, len(remaining), n_folds, n_estimators)
+            scores = self._score_candidates(
+                base_estimator, data,
+                [candidates[i] for i in remaining],
+                folds[:n_folds], n_estimators)
+            for i, this_scores in zip(remaining, scores):
+                candidate_scores[i] = this_scores
+            if len(remaining) == 1:
+                break
+            # keep the candidates with the best score at any number of
+            # estimators. `sorted` is stable so ties keep the grid order
+            ranked = sorted(
+                remaining,
+                key=lambda i: max(score.mean_validation_score
+                                  for score in candidate_scores[i]),
+                reverse=True)
+            remaining = sorted(
+                ranked[:max(1, len(remaining) // self.factor)])
+
+        best = sorted(candidate_scores[remaining[0]],
+                      key=lambda x: x.mean_validation_score,
+                      reverse=True)[0]
+
+        grid_scores = list()
+        for scores in candidate_scores:
+            grid_scores.extend(scores)
+            last = scores[-1]
+            for n_estimators in range(
+                    last.parameters['n_estimators'] + 1,
+                    self.max_n_estimators + 1):
+                grid_scores.append(_CVScoreTuple(
+                    dict(last.parameters, n_estimators=n_estimators),
+                    last.mean_validation_score,
+                    last.cv_validation_scores))
+        return grid_scores, best
@@ -0,0 +1,203 @@
+"""
+Vectorized histogram filling
+
+HistFiller fills many histograms from the same set of events. The bin index
+of each event is computed once per field and axis binning with
+np.searchsorted and is shared by all histograms using that field and binning,
+for example the nominal and systematic variations of the same histogram or
+several 2D histograms sharing an axis. The sum of weights and the sum of
+squared weights of each bin are then accumulated with np.bincount and added to
+the histograms.
+"""
+from array import array
+
+import numpy as np
+
+from . import log; log = log[__name__]
+
+# the number of statistics stored by TH1::GetStats for 1, 2 and 3 dimensions
+NSTATS = {1: 4, 2: 7, 3: 11}
+
+
+def axis_edges(axis):
+    """
+    Return the bin edges of a ROOT axis
+    """
+    nbins = axis.GetNbins()
+    return tuple(axis.GetBinLowEdge(i) for i in xrange(1, nbins + 2))
+
+
+def hist_axes(hist):
+    axes = [hist.GetXaxis(), hist.GetYaxis(), hist.GetZaxis()]
+    return [axis_edges(axis) for axis in axes[:hist.GetDimension()]]
+
+
+def find_bins(values, edges):
+    """
+    Return the bin indices following the ROOT convention:
+    0 is the underflow and len(edges) is the overflow
+    """
+    return np.searchsorted(np.asarray(edges), values, side='right')
+
+
+class HistFiller(object):
+    """
+    Fill many histograms from the same columns in one pass.
+
+    columns is any mapping of field names to arrays such as a record array.
+    Fields may also be given directly as arrays of the same length. Values of
+    fields in field_scale are multiplied by the scale before binning.
+    """
+    def __init__(self, columns, field_scale=None):
+        self.columns = columns
+        self.field_scale = field_scale
+        self.requests = []
+        self._columns = {}
+        self._axis_bins = {}
+        self._bins = {}
+
+    def column(self, field):
+        if not isinstance(field, basestring):
+            return field
+        try:
+            return self._columns[field]
+        except KeyError:
+            values = self.columns[field]
+            if self.field_scale is not None and field in self.field_scale:
+                values = values * self.field_scale[field]
+            self._columns[field] = values
+            return values
+
+    def field_key(self, field):
+        if isinstance(field, basestring):
+            return field
+        return id(field)
+
+    def axis_bins(self, field, edges):
+        key = (self.field_key(field), edges)
+        try:
+            return self._axis_bins[key]
+        except KeyError:
+            bins = self._axis_bins[key] = find_bins(self.column(field), edges)
+            return bins
+
+    def bins(self, fields, axes):
+        """
+        Return the global ROOT bin index of each event
+        """
+        key = (tuple(self.field_key(field) for field in fields),
+               tuple(axes))
+        try:
+            return self._bins[key]
+        except KeyError:
+            pass
+        index = None
+        stride = 1
+        for field, edges in zip(fields, axes):
+            bins = self.axis_bins(field, edges)
+            if index is None:
+                index = bins.astype(np.intp)
+            else:
+                index = index + stride * bins
+            stride *= len(edges) + 1
+        self._bins[key] = index
+        return index
+
+    def add(self, fields, hist, weights=None, selection=None):
+        """
+        Request filling hist with the fields (one per axis) and weights.
+        selection is an optional boolean mask or index array of the events
+        to fill.
+        """
+        if hist.GetDimension() != len(fields):
+            raise TypeError(
+                'histogram dimensionality does not match '
+                'number of fields')
+        for field in fields:
+            if not isinstance(field, basestring):
+                # keep the array alive while its id is used as a key
+                self._columns[id(field)] = field
+        self.requests.append((list(fields), hist, weights, selection))
+
+    def fill(self):
+        """
+        Fill all requested histograms
+        """
+        for fields, hist, weights, selection in self.requests:
+            axes = hist_axes(hist)
+            bins = self.bins(fields, axes)
+            values = [self.column(field) for field in fields]
+            if selection is not None:
+                bins = bins[selection]
+                values = [v[selection] for v in values]
+                if weights is not None:
+                    weights = weights[selection]
+            if weights is None:
+                weights = np.ones(len(bins))
+            add_to_hist(hist, axes, bins, values, weights)
+        self.requests = []
+
+
+def add_to_hist(hist, axes, bins, values, weights):
+    """
+    Add the events with the given global bin indices to a histogram
+    """
+    ncells = reduce(lambda n, edges: n * (len(edges) + 1), axes, 1)
+    sumw = np.bincount(bins, weights=weights, minlength=ncells)
+    sumw2 = np.bincount(bins, weights=weights * weights, minlength=ncells)
+
+    # the statistics are reset by SetBinContent so get them first
+    ndim = len(axes)
+    stats = array('d', [0.] * 13)
+    hist.GetStats(stats)
+    entries = hist.GetEntries()
+
+    if hist.GetSumw2N() == 0:
+        hist.Sumw2()
+    for cell in np.flatnonzero((sumw != 0) | (sumw2 != 0)):
+        cell = int(cell)
+        hist.SetBinContent(cell, hist.GetBinContent(cell) + sumw[cell])
+        hist.SetBinError(cell, np.sqrt(
+            hist.GetBinError(cell) ** 2 + sumw2[cell]))
+
+    # only events inside the axis ranges contribute to the statistics
+    inside = np.ones(len(bins), dtype=np.bool)
+    for value_bins, edges in zip(
+            unravel_bins(bins, axes), axes):
+        inside &= (value_bins > 0) & (value_bins < len(edges))
+    w = weights[inside]
+    x = [v[inside] for v in values]
+    new_stats = [w.sum(), (w * w).sum()]
+    new_stats += [(w * x[0]).sum(), (w * x[0] * x[0]).sum()]
+    if ndim > 1:
+        new_stats += [(w * x[1]).sum(), (w * x[1] * x[1]).sum(),
+                      (w * x[0] * x[1]).sum()]
+    if ndim > 2:
+        new_stats += [(w * x[2]).sum(), (w * x[2] * x[2]).sum(),
+                      (w * x[0] * x[2]).sum(), (w * x[1] * x[2]).sum()]
+    for i in xrange(NSTATS[ndim]):
+        stats[i] += new_stats[i]
+    hist.PutStats(stats)
+    hist.SetEntries(entries + len(bins))
+
+
+def unravel_bins(bins, axes):
+    """
+    Return the bin index along each axis of global ROOT bin indices
+    """
+    axis_bins = []
+    for edges in axes:
+        n = len(edges) + 1
+        axis_bins.append(bins % n)
+        bins = bins // n
+    return axis_bins
+
+
+def fill_hists(columns, requests, field_scale=None):
+    """
+    Fill (fields, hist, weights) requests from the same columns
+    """
+    filler = HistFiller(columns, field_scale=field_scale)
+    for fields, hist, weights in requests:
+        filler.add(fields, hist, weights)
+    filler.fill()
@@ -1,6 +1,5 @@
 # numpy imports
 import numpy as np
-from numpy.lib import recfunctions
 
 # rootpy imports
 from rootpy import asrootpy
@@ -9,8 +8,8 @@ from rootpy.plotting import Hist
 # local imports
 from . import log; log = log[__name__]
 from .sample import Sample
-from .db import TEMPFILE, get_file
-from ..cachedtable import CachedTable
+from .db import TEMPFILE, read_table
+from ..batch import EventBatch
 from ..lumi import LUMI
 
 
@@ -56,9 +55,8 @@ class Data(Sample):
             year=year, scale=1.,
             name=name, label=label,
             **kwargs)
-        h5file = get_file(self.ntuple_path, self.student, hdf=True)
         dataname = 'data%d_JetTauEtmiss' % (year % 1E3)
-        self.h5data = CachedTable.hook(getattr(h5file.root, dataname))
+        self.h5data = self.get_table(dataname)
         self.info = DataInfo(LUMI[self.year] / 1e3, self.energy)
 
     def draw_array(self, field_hist, category, region,
@@ -72,10 +70,11 @@ class Data(Sample):
                    max_score=None,
                    systematics=True,
                    systematics_components=None,
-                   bootstrap_data=False):
+                   bootstrap_data=False,
+                   chunksize=None):
         if bootstrap_data:
             scores = None
-        elif scores is None and clf is not None:
+        elif scores is None and clf is not None and chunksize is None:
             scores = self.scores(clf, category, region, cuts=cuts)
         elif isinstance(scores, dict):
             scores = scores['NOMINAL']
@@ -91,7 +90,8 @@ class Data(Sample):
             scores=scores,
             min_score=min_score,
             max_score=max_score,
-            bootstrap_data=bootstrap_data)
+            bootstrap_data=bootstrap_data,
+            chunksize=chunksize)
 
     def scores(self, clf, category, region,
                cuts=None,
@@ -102,6 +102,9 @@ class Data(Sample):
                 region=region,
                 cuts=cuts)
 
+    def score_tables(self, systematic='NOMINAL'):
+        return [self.h5data]
+
     def records(self,
                 category=None,
                 region=None,
@@ -110,7 +113,12 @@ class Data(Sample):
                 include_weight=True,
                 systematic='NOMINAL',
                 return_idx=False,
+                as_batch=False,
+                chunksize=None,
                 **kwargs):
+        """
+        See SystematicsSample.records
+        """
         if include_weight and fields is not None:
             if 'weight' not in fields:
                 fields = list(fields) + ['weight']
@@ -120,27 +128,55 @@ class Data(Sample):
         log.info("requesting table from Data %d" % self.year)
         log.debug("using selection: %s" % selection)
 
+        # only decode the columns that are actually needed
+        read_fields = None
+        if fields is not None:
+            read_fields = tuple(f for f in fields if f != 'weight')
+
+        def make_batch(rec):
+            batch = EventBatch.from_records(rec)
+            # add weight field
+            if include_weight:
+                # data is not weighted
+                batch['weight'] = np.ones(rec.shape[0], dtype='f8')
+            if fields is not None:
+                batch = batch[fields]
+            if not as_batch:
+                batch = batch.to_records()
+            return batch
+
+        condition = selection.where() if selection else None
+        if chunksize is not None:
+            return self.iter_chunks(condition, read_fields, chunksize,
+                                    make_batch, return_idx)
+
         # read the table with a selection
-        if selection:
-            rec = self.h5data.read_where(selection.where(), **kwargs)
+        # the coordinates come from the same selection pass
+        parent, refinement = self.split_cuts(category, region, cuts=cuts)
+        if parent is not None:
+            # refine the cached rows passing the parent selection
+            rec, idx = read_table(
+                self.h5data, refinement.where(), parent=parent.where(),
+                fields=read_fields, return_coords=True, **kwargs)
         else:
-            rec = self.h5data.read(**kwargs)
+            rec, idx = read_table(
+                self.h5data, condition, fields=read_fields,
+                return_coords=True, **kwargs)
 
-        # add weight field
-        if include_weight:
-            # data is not weighted
-            weights = np.ones(rec.shape[0], dtype='f8')
-            rec = recfunctions.rec_append_fields(rec,
-                names='weight',
-                data=weights,
-                dtypes='f8')
-
-        if fields is not None:
-            rec = rec[fields]
+        batch = make_batch(rec)
 
         if return_idx:
-            # only valid if selection is non-empty
-            idx = self.h5data.get_where_list(selection.where(), **kwargs)
-            return [(rec, idx)]
-
-        return [rec]
+            return [(batch, idx)]
+
+        return [batch]
+
+    def iter_chunks(self, condition, fields, chunksize,
+                    make_batch, return_idx=False):
+        for rec, idx in self.h5data.iter_fields(
+                condition, fields=fields, chunksize=chunksize):
+            if len(rec) == 0:
+                continue
+            if return_idx:
+                yield make_batch(rec), idx
+            else:
+                yield make_batch(rec)
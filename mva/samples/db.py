@@ -1,6 +1,8 @@
 # stdlib imports
 import os
 import atexit
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
 
 # pytables imports
 import tables
@@ -13,13 +15,38 @@ from higgstautau import datasets
 
 # local imports
 from .. import NTUPLE_PATH, DEFAULT_STUDENT
+from ..cachedtable import CachedTable, set_selection_pool
+from ..columnstore import ColumnTable
+from ..cutflowindex import CutflowIndex, index_path
+from ..selectionmasks import SelectionMasks, MANIFEST as MASK_MANIFEST
 from . import log; log = log[__name__]
 
 
 DB = datasets.Database(name='datasets_hh', verbose=False)
 FILES = {}
+TABLES = {}
+MASKS = {}
+CUTFLOWS = {}
 TEMPFILE = TemporaryFile()
 
+# read the ntuple tables from hhskim.h5 (hdf5) or from the memory-mapped
+# columnar store built with ntup-columns (columns)
+NTUPLE_BACKEND = os.getenv('NTUPLE_BACKEND', 'hdf5')
+if NTUPLE_BACKEND not in ('hdf5', 'columns'):
+    raise ValueError("invalid NTUPLE_BACKEND: {0}".format(NTUPLE_BACKEND))
+
+# number of threads reading the datasets of a sample concurrently
+# (see set_read_workers)
+READ_WORKERS = int(os.getenv('READ_WORKERS', 1))
+READ_POOL = None
+# PyTables is not thread-safe so with the hdf5 backend the selections of
+# the read threads are evaluated in this many processes
+SELECTION_POOL = None
+
+# select the rows passing the preselection (the common cuts of the
+# categories) once per table and refine them in memory for each category
+REUSE_PARENT_SELECTIONS = not os.getenv('NOPARENTSELECTION', None)
+
 
 def get_file(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT, hdf=False, suffix='', force_reopen=False):
     ext = '.h5' if hdf else '.root'
@@ -36,8 +63,147 @@ def get_file(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT, hdf=False, suffix
     return student_file
 
 
+def get_table(name, ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT,
+              force_reopen=False):
+    if NTUPLE_BACKEND == 'columns':
+        path = os.path.join(ntuple_path, student, student + '.columns', name)
+        if path not in TABLES or force_reopen:
+            log.info("opening {0} ...".format(path))
+            TABLES[path] = ColumnTable(path)
+        return TABLES[path]
+    h5file = get_file(ntuple_path, student, hdf=True,
+                      force_reopen=force_reopen)
+    return CachedTable.hook(getattr(h5file.root, name))
+
+
+def read_table(table, condition, parent=None, **kwargs):
+    """
+    Call read_fields of a table from any thread. If a parent selection is
+    given then the condition is only evaluated on the cached rows passing
+    the parent (see read_refined).
+
+    Memory-mapped columns are read concurrently. HDF5 tables only serialize
+    the calls into PyTables (see HDF5_LOCK in cachedtable) and the
+    selections run concurrently in the selection pool.
+    """
+    if parent is not None:
+        return table.read_refined(parent, condition, **kwargs)
+    return table.read_fields(condition, **kwargs)
+
+
+@atexit.register
+def close_read_pools():
+    global READ_POOL, SELECTION_POOL
+    if READ_POOL is not None:
+        READ_POOL.close()
+        READ_POOL = None
+    if SELECTION_POOL is not None:
+        set_selection_pool(None)
+        SELECTION_POOL.terminate()
+        SELECTION_POOL.join()
+        SELECTION_POOL = None
+
+
+def set_read_workers(workers):
+    """
+    Read the datasets of a sample with this many threads (the READ_WORKERS
+    environment variable or --read-workers of the scripts)
+    """
+    global READ_WORKERS
+    close_read_pools()
+    READ_WORKERS = workers
+
+
+def map_reads(func, items):
+    """
+    Apply func to each item using READ_WORKERS threads. The results are
+    returned in the order of the items.
+    """
+    global READ_POOL, SELECTION_POOL
+    items = list(items)
+    if READ_WORKERS <= 1 or len(items) <= 1:
+        return map(func, items)
+    if READ_POOL is None:
+        if NTUPLE_BACKEND == 'hdf5':
+            # each process opens its own handle of the HDF5 file
+            SELECTION_POOL = Pool(READ_WORKERS)
+            set_selection_pool(SELECTION_POOL)
+        READ_POOL = ThreadPool(READ_WORKERS)
+    return READ_POOL.map(func, items)
+
+
+def get_selection_masks(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT):
+    """
+    Return the precomputed selection masks of the columnar store or None if
+    the columnar backend is not used or the masks were not computed
+    """
+    if NTUPLE_BACKEND != 'columns':
+        return None
+    store = os.path.join(ntuple_path, student, student + '.columns')
+    if store not in MASKS:
+        if os.path.isfile(os.path.join(store, MASK_MANIFEST)):
+            MASKS[store] = SelectionMasks.load(store)
+        else:
+            log.warning("no selection masks found in {0}".format(store))
+            MASKS[store] = None
+    return MASKS[store]
+
+
+def get_cutflow_index(ntuple_path=NTUPLE_PATH, student=DEFAULT_STUDENT,
+                      force_reopen=False):
+    """
+    Return the cutflow index written with the ntuple (see ntup-cutflows)
+    or None if it does not exist or is older than the ROOT file
+    """
+    path = index_path(ntuple_path, student)
+    if path not in CUTFLOWS or force_reopen:
+        index = None
+        if os.path.isfile(path):
+            index = CutflowIndex.load(path)
+            if index.is_stale(os.path.join(
+                    ntuple_path, student, student + '.root')):
+                log.warning("ignoring outdated cutflow index {0}".format(path))
+                index = None
+        else:
+            log.warning("no cutflow index found at {0}".format(path))
+        CUTFLOWS[path] = index
+    return CUTFLOWS[path]
+
+
+def get_events(name, events_bin, ntuple_path=NTUPLE_PATH,
+               student=DEFAULT_STUDENT, force_reopen=False):
+    """
+    Return the content of a bin of the cutflow histogram for a table.
+    The cutflow index (see ntup-cutflows) is used if it is up to date,
+    otherwise the bin is read from the ntuple.
+    """
+    index = get_cutflow_index(ntuple_path, student, force_reopen)
+    if index is not None:
+        events = index.get(name, events_bin)
+        if events is not None:
+            return events
+        log.warning("{0} not found in the cutflow index".format(name))
+    return read_events(name, events_bin, ntuple_path, student, force_reopen)
+
+
+def read_events(name, events_bin, ntuple_path=NTUPLE_PATH,
+                student=DEFAULT_STUDENT, force_reopen=False):
+    """
+    Read the content of a bin of the cutflow histogram from the ntuple
+    """
+    if NTUPLE_BACKEND == 'columns':
+        table = get_table(name, ntuple_path, student, force_reopen)
+        if table.cutflow is not None:
+            return table.cutflow[events_bin]
+        log.warning("no cutflow stored for {0}".format(name))
+    rfile = get_file(ntuple_path, student, force_reopen=force_reopen)
+    return rfile[name + '_cutflow'][events_bin].value
+
+
 @atexit.register
 def cleanup():
+    if READ_POOL is not None:
+        READ_POOL.close()
     if TEMPFILE:
         TEMPFILE.close()
     for filehandle in FILES.values():
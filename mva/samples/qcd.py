@@ -111,7 +111,8 @@ class QCD(Sample, Background):
                    max_score=None,
                    systematics=True,
                    systematics_components=None,
-                   bootstrap_data=False):
+                   bootstrap_data=False,
+                   chunksize=None):
 
         if scores is not None:
             log.warning(
@@ -136,7 +137,8 @@ class QCD(Sample, Background):
                 max_score=max_score,
                 systematics=systematics,
                 systematics_components=systematics_components,
-                scale=mc_scale)
+                scale=mc_scale,
+                chunksize=chunksize)
 
         field_hist_data = dict([(expr, hist.Clone())
             for expr, hist in field_hist.items()])
@@ -150,7 +152,8 @@ class QCD(Sample, Background):
             clf=clf,
             #scores=scores,
             min_score=min_score,
-            max_score=max_score)
+            max_score=max_score,
+            chunksize=chunksize)
 
         for expr, h in field_hist.items():
             mc_h = field_hist_MC_bkg[expr]
@@ -259,6 +262,7 @@ class QCD(Sample, Background):
                 include_weight=True,
                 systematic='NOMINAL',
                 return_idx=False,
+                as_batch=False,
                 **kwargs):
         assert include_weight == True
         data_records = self.data.records(
@@ -268,16 +272,13 @@ class QCD(Sample, Background):
             cuts=cuts,
             include_weight=include_weight,
             systematic='NOMINAL',
-            return_idx=return_idx,
+            return_idx=True,
+            as_batch=True,
             **kwargs)
 
-        if return_idx:
-            arrays = [(d.copy(), idx) for d, idx in data_records]
-        else:
-            arrays = [d.copy() for d in data_records]
+        arrays = list(data_records)
 
         for mc_scale, mc in zip(self.mc_scales, self.mc):
-            _arrays = []
             _arrs = mc.records(
                 category=category,
                 region=self.shape_region,
@@ -286,20 +287,14 @@ class QCD(Sample, Background):
                 include_weight=include_weight,
                 systematic=systematic,
                 scale=mc_scale,
-                return_idx=return_idx,
+                return_idx=True,
+                as_batch=True,
                 **kwargs)
             # FIX: weight may not be present if include_weight=False
-            if return_idx:
-                for partition, idx in _arrs:
-                    partition = partition.copy()
-                    partition['weight'] *= -1
-                    _arrays.append((partition, idx))
-            else:
-                for partition in _arrs:
-                    partition = partition.copy()
-                    partition['weight'] *= -1
-                    _arrays.append(partition)
-            arrays.extend(_arrays)
+            for partition, idx in _arrs:
+                # replace the weights instead of modifying the table reads
+                partition['weight'] = partition['weight'] * -1
+                arrays.append((partition, idx))
 
         scale = self.scale
         if systematic == ('QCDFIT_UP',):
@@ -308,14 +303,15 @@ class QCD(Sample, Background):
             scale -= self.scale_error
 
         # FIX: weight may not be present if include_weight=False
-        if return_idx:
-            for partition, idx in arrays:
-                partition['weight'] *= scale
-        else:
-            for partition in arrays:
-                partition['weight'] *= scale
+        for partition, idx in arrays:
+            partition['weight'] = partition['weight'] * scale
 
-        return arrays
+        if not as_batch:
+            arrays = [(partition.to_records(), idx)
+                      for partition, idx in arrays]
+        if return_idx:
+            return arrays
+        return [partition for partition, idx in arrays]
 
     def get_shape_systematic(self, nominal_hist, expr_or_clf,
                              category, region, **kwargs):
@@ -3,11 +3,11 @@ import os
 import sys
 import pickle
 from operator import add, itemgetter
-from collections import namedtuple
+from functools import partial
+from collections import namedtuple, Mapping, OrderedDict
 
 # numpy imports
 import numpy as np
-from numpy.lib import recfunctions
 
 # rootpy imports
 import ROOT
@@ -18,7 +18,7 @@ from rootpy.stats import histfactory
 from rootpy import asrootpy
 
 # root_numpy imports
-from root_numpy import rec2array, stack, fill_hist
+from root_numpy import fill_hist
 
 # higgstautau imports
 from higgstautau import samples as samples_db
@@ -32,15 +32,62 @@ from ..classify import histogram_scores, Classifier
 from ..regions import REGIONS
 from ..systematics import (
     get_systematics, SYSTEMATICS_BY_WEIGHT,
-    iter_systematics, systematic_name)
+    iter_systematics, systematic_name, weight_systematics_field)
 from ..lumi import LUMI, get_lumi_uncert
-from .db import DB, TEMPFILE, get_file
-from ..cachedtable import CachedTable
+from .db import (
+    DB, TEMPFILE, get_file, get_table, get_events, get_selection_masks,
+    read_table, map_reads, REUSE_PARENT_SELECTIONS)
 from ..variables import get_binning, get_scale
+from ..histfill import HistFiller
+from ..batch import EventBatch
 
 BCH_UNCERT = pickle.load(open(os.path.join(CACHE_DIR, 'bch_cleaning.cache')))
 
 
+def unique_fields(fields):
+    """
+    Remove duplicate fields while preserving their order
+    """
+    seen = set()
+    return [f for f in fields if not (f in seen or seen.add(f))]
+
+
+class LazyMapping(Mapping):
+    """
+    Mapping of keys to values loaded from a name on first access.
+    Used for the tables and event counts of datasets so that systematic
+    tables are only opened when a systematic is actually requested.
+    """
+    def __init__(self, load):
+        self.load = load
+        self.names = OrderedDict()
+        self.loaded = {}
+
+    def add(self, key, name):
+        self.names[key] = name
+        self.loaded.pop(key, None)
+
+    def name(self, key):
+        return self.names[key]
+
+    def __getitem__(self, key):
+        try:
+            return self.loaded[key]
+        except KeyError:
+            value = self.loaded[key] = self.load(self.names[key])
+            return value
+
+    def __contains__(self, key):
+        # do not load the value
+        return key in self.names
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
 class Dataset(namedtuple('Dataset',
                          ('ds', 'tables', 'events',
                           'xs', 'kfact', 'effic'))):
@@ -104,6 +151,12 @@ class Sample(object):
     def corrections(self, rec):
         return []
 
+    def correction_fields(self):
+        """
+        Fields required by corrections()
+        """
+        return []
+
     def __init__(self, year, scale=1., cuts=None,
                  ntuple_path=NTUPLE_PATH,
                  student=DEFAULT_STUDENT,
@@ -132,6 +185,14 @@ class Sample(object):
             self.hist_decor['fillstyle'] = 'solid'
         self.trigger = trigger
 
+    def get_table(self, name):
+        return get_table(name, self.ntuple_path, self.student,
+                         force_reopen=self.force_reopen)
+
+    def get_events(self, name, events_bin):
+        return get_events(name, events_bin, self.ntuple_path, self.student,
+                          force_reopen=self.force_reopen)
+
     def decorate(self, name=None, label=None, **hist_decor):
         if name is not None:
             self.name = name
@@ -203,8 +264,13 @@ class Sample(object):
                        field_scale=None,
                        weight_hist=None,
                        weighted=True,
-                       bootstrap_data=False):
-
+                       bootstrap_data=False,
+                       chunksize=None):
+        """
+        Return the filled histograms along with the filled events and their
+        weights. If chunksize is given the events are never held at once
+        (see draw_array) and both are None.
+        """
         do_systematics = (isinstance(self, SystematicsSample)
                           and self.systematics
                           and systematics)
@@ -249,7 +315,8 @@ class Sample(object):
             max_score=max_score,
             systematics=do_systematics,
             systematics_components=systematics_components,
-            bootstrap_data=bootstrap_data)
+            bootstrap_data=bootstrap_data,
+            chunksize=chunksize)
 
         return field_hist, rec, weights
 
@@ -276,8 +343,13 @@ class Sample(object):
                                      bootstrap_data=False,
                                      ravel=True,
                                      uniform=False,
-                                     mva=False):
-
+                                     mva=False,
+                                     chunksize=None):
+        """
+        If chunksize is given the events are read in chunks and the
+        sample-specific histfactory hooks are called with rec=None and
+        weights=None (see get_hist_array)
+        """
         from .data import Data
         from .qcd import QCD
         from .others import Others
@@ -295,7 +367,8 @@ class Sample(object):
             field_scale=field_scale,
             weight_hist=weight_hist,
             weighted=weighted,
-            bootstrap_data=bootstrap_data)
+            bootstrap_data=bootstrap_data,
+            chunksize=chunksize)
         do_systematics = (not isinstance(self, Data)
                           and self.systematics
                           and systematics)
@@ -413,6 +486,7 @@ class Sample(object):
             if hasattr(self, 'histfactory') and not (
                     isinstance(self, Signal) and no_signal_fixes):
                 # perform sample-specific items
+                # (rec and weights are None when reading in chunks)
                 self.histfactory(sample, category,
                                  systematics=do_systematics,
                                  rec=rec, weights=weights,
@@ -430,46 +504,61 @@ class Sample(object):
               systematic='NOMINAL',
               key=None,
               num_partitions=2,
-              return_idx=False):
+              return_idx=False,
+              weight_systematics=None,
+              as_batch=False):
         """
         Partition sample into num_partitions chunks of roughly equal size
         assuming no correlation between record index and field values.
+
+        The selection is read once along with the key field and the events
+        are split in memory: event i goes into partition abs(key) % N or,
+        if key is None, into partition (table row index) % N.
         """
-        partitions = []
-        for start in range(num_partitions):
+        kwargs = {}
+        if weight_systematics:
+            kwargs['weight_systematics'] = weight_systematics
+        read_fields = fields
+        if key is not None and fields is not None and key not in fields:
+            read_fields = list(fields) + [key]
+        if key is None:
+            log.info("splitting records by index modulo {0:d}".format(
+                num_partitions))
+        else:
+            log.info("splitting records by {0} modulo {1:d}".format(
+                key, num_partitions))
+        recs = self.records(
+            category=category,
+            region=region,
+            fields=read_fields,
+            include_weight=include_weight,
+            cuts=cuts,
+            systematic=systematic,
+            return_idx=True,
+            as_batch=True,
+            **kwargs)
+        partitions = [[] for _ in xrange(num_partitions)]
+        for rec, idx in recs:
             if key is None:
-                # split by index
-                log.info("splitting records by index parity")
-                recs = self.records(
-                    category=category,
-                    region=region,
-                    fields=fields,
-                    include_weight=include_weight,
-                    cuts=cuts,
-                    systematic=systematic,
-                    return_idx=return_idx,
-                    start=start,
-                    step=num_partitions)
-            else:
-                # split by field values modulo the number of partitions
-                partition_cut = Cut('((abs({0})%{1})>={2})&&((abs({0})%{1})<{3})'.format(
-                    key, num_partitions, start, start + 1))
-                log.info(
-                    "splitting records by key parity: {0}".format(
-                        partition_cut))
-                recs = self.records(
-                    category=category,
-                    region=region,
-                    fields=fields,
-                    include_weight=include_weight,
-                    cuts=partition_cut & cuts,
-                    systematic=systematic,
-                    return_idx=return_idx)
-            if return_idx:
-                partitions.append(recs)
+                partition = idx % num_partitions
             else:
-                partitions.append(np.hstack(recs))
-        return partitions
+                partition = np.abs(rec[key]) % num_partitions
+            if read_fields is not fields:
+                # drop the key that was only read to split the events
+                rec = rec[[name for name in rec.names if name != key]]
+            for i in xrange(num_partitions):
+                in_partition = partition == i
+                partitions[i].append((rec[in_partition], idx[in_partition]))
+        if return_idx:
+            if as_batch:
+                return partitions
+            return [[(rec.to_records(), idx) for rec, idx in partition]
+                    for partition in partitions]
+        partitions = [EventBatch.concatenate([rec for rec, _ in partition])
+                      for partition in partitions]
+        if as_batch:
+            return partitions
+        return [partition.to_records() for partition in partitions]
 
     def merged_records(self,
                        category=None,
@@ -480,18 +569,55 @@ class Sample(object):
                        clf_name='classifier',
                        scores=None,
                        include_weight=True,
-                       systematic='NOMINAL'):
+                       systematic='NOMINAL',
+                       weight_systematics=None):
+        return self.merged_batch(
+            category=category,
+            region=region,
+            fields=fields,
+            cuts=cuts,
+            clf=clf,
+            clf_name=clf_name,
+            scores=scores,
+            include_weight=include_weight,
+            systematic=systematic,
+            weight_systematics=weight_systematics).to_records()
+
+    def merged_batch(self,
+                     category=None,
+                     region=None,
+                     fields=None,
+                     cuts=None,
+                     clf=None,
+                     clf_name='classifier',
+                     scores=None,
+                     include_weight=True,
+                     systematic='NOMINAL',
+                     weight_systematics=None):
+        """
+        Same as merged_records but return an EventBatch. The records of all
+        datasets are only concatenated when a field is accessed.
+        """
+        kwargs = {}
+        if weight_systematics:
+            kwargs['weight_systematics'] = weight_systematics
         recs = self.records(
             category=category,
             region=region,
             fields=fields,
             include_weight=include_weight,
             cuts=cuts,
-            systematic=systematic)
+            systematic=systematic,
+            as_batch=True,
+            **kwargs)
         if include_weight and fields is not None:
             if 'weight' not in fields:
                 fields = list(fields) + ['weight']
-        rec = stack(recs, fields=fields)
+            if weight_systematics:
+                fields = list(fields) + [
+                    weight_systematics_field(sys)
+                    for sys in weight_systematics]
+        batch = EventBatch.concatenate(recs, fields=fields)
         if clf is not None or scores is not None:
             if scores is None:
                 scores, _ = clf.classify(
@@ -503,14 +629,11 @@ class Sample(object):
             elif isinstance(scores, tuple):
                 # ignore weights
                 scores = scores[0]
-            rec = recfunctions.rec_append_fields(rec,
-                names=clf_name,
-                data=scores,
-                dtypes='f4')
-        return rec
+            batch[clf_name] = np.asarray(scores, dtype='f4')
+        return batch
 
     def array(self, *args, **kwargs):
-        return rec2array(self.merged_records(*args, **kwargs))
+        return self.merged_batch(*args, **kwargs).to_array()
 
     def weights(self, systematic='NOMINAL'):
         weight_fields = self.weight_fields()
@@ -535,14 +658,32 @@ class Sample(object):
             weight_fields.extend(['tau1_trigger_eff', 'tau2_trigger_eff'])
         return weight_fields
 
-    def cuts(self, category=None, region=None, systematic='NOMINAL', **kwargs):
+    def cuts(self, category=None, region=None, systematic='NOMINAL',
+             selection_masks=True, common_only=False, **kwargs):
+        """
+        If common_only is True then only the common cuts of the category are
+        applied (see split_cuts)
+        """
         cuts = Cut(self._cuts)
+        selections = []
         if category is not None:
-            cuts &= category.get_cuts(self.year, **kwargs)
+            if common_only:
+                selections.append(Cut(category.common_cuts))
+            else:
+                selections.append(category.get_cuts(self.year, **kwargs))
         if region is not None:
-            cuts &= REGIONS[region]
+            selections.append(REGIONS[region])
         if self.trigger:
-            cuts &= Cut('trigger')
+            selections.append(Cut('trigger'))
+        masks = None
+        if selection_masks:
+            masks = get_selection_masks(self.ntuple_path, self.student)
+        if masks is not None:
+            # test the precomputed category, region and trigger bits at once
+            cuts &= masks.select(selections)
+        else:
+            for selection in selections:
+                cuts &= selection
         if isinstance(self, SystematicsSample):
             systerm, variation = SystematicsSample.get_sys_term_variation(
                 systematic)
@@ -553,20 +694,31 @@ class Sample(object):
                     cuts &= variations['NOMINAL']
         return cuts
 
-    def draw_array_helper(self, field_hist, category, region,
-                          cuts=None,
-                          weighted=True,
-                          field_scale=None,
-                          weight_hist=None,
-                          field_weight_hist=None,
-                          clf=None,
-                          scores=None,
-                          min_score=None,
-                          max_score=None,
-                          systematic='NOMINAL',
-                          scale=1.,
-                          bootstrap_data=False):
-        from .data import Data, DataInfo
+    def split_cuts(self, category=None, region=None, systematic='NOMINAL',
+                   cuts=None):
+        """
+        Split the selection into a parent selection shared by all categories
+        with the same common cuts (the preselection) and the cuts refining
+        it. Return (None, selection) if the parent is not reused.
+        """
+        if (not REUSE_PARENT_SELECTIONS or category is None or
+                not category.common_cuts):
+            return None, self.cuts(category, region, systematic) & cuts
+        parent = self.cuts(category, region, systematic, common_only=True)
+        return parent, category.get_refinement_cuts(self.year) & cuts
+
+    def score_tables(self, systematic='NOMINAL'):
+        """
+        Return the tables read by records in the order of the returned
+        records, or None if the scores of this sample are not stored
+        (see ScoreStore)
+        """
+        return None
+
+    def draw_array_fields(self, field_hist):
+        """
+        Return the fields and the classifier required to fill field_hist
+        """
         all_fields = []
         classifiers = []
         for f in field_hist.iterkeys():
@@ -587,20 +739,80 @@ class Sample(object):
             classifier = classifiers[0]
         else:
             classifier = None
-        if isinstance(self, Data) and bootstrap_data:
+        return all_fields, classifier
+
+    def draw_array_helper(self, field_hist, category, region,
+                          cuts=None,
+                          weighted=True,
+                          field_scale=None,
+                          weight_hist=None,
+                          field_weight_hist=None,
+                          clf=None,
+                          scores=None,
+                          min_score=None,
+                          max_score=None,
+                          systematic='NOMINAL',
+                          scale=1.,
+                          bootstrap_data=False,
+                          rec=None,
+                          weight_field='weight',
+                          filler=None,
+                          chunksize=None):
+        """
+        Fill the histograms in field_hist.
+
+        If rec is given then it is used instead of reading the records.
+        This allows filling several systematics from one read, with the
+        weights in weight_field. The weights of a given rec are copied before
+        they are modified so the rec can be shared by several calls.
+
+        If a HistFiller of rec is given then the histograms are only added to
+        it and are filled when the caller calls filler.fill().
+
+        If chunksize is given and the scores are not given then the events
+        are read, scored and filled in chunks of at most chunksize table rows
+        (see records) and (None, None) is returned instead of the filled
+        events.
+        """
+        from .data import Data
+        all_fields, classifier = self.draw_array_fields(field_hist)
+        fill_kwargs = dict(
+            field_scale=field_scale,
+            weight_hist=weight_hist,
+            field_weight_hist=field_weight_hist,
+            min_score=min_score,
+            max_score=max_score,
+            scale=scale)
+        shared_rec = rec is not None
+        if (chunksize is not None and not shared_rec and scores is None and
+                not (isinstance(self, Data) and bootstrap_data)):
+            # an explicitly passed classifier is applied for the score cuts
+            self.draw_chunks(field_hist, category, region,
+                             cuts=cuts,
+                             clf=clf if clf is not None else classifier,
+                             systematic=systematic,
+                             chunksize=chunksize,
+                             **fill_kwargs)
+            self.add_datainfo(field_hist)
+            return None, None
+        if shared_rec:
+            if scores is None and 'classifier' in rec:
+                scores = rec['classifier']
+        elif isinstance(self, Data) and bootstrap_data:
             log.info("using bootstrapped data")
             analysis = bootstrap_data
             recs = []
             scores = []
             for s in analysis.backgrounds:
-                rec = s.merged_records(category, region,
+                rec = s.merged_batch(category, region,
                     fields=all_fields, cuts=cuts,
                     include_weight=True,
                     clf=clf,
                     systematic=systematic)
                 recs.append(rec)
-            b_rec = stack(recs, fields=all_fields + ['classifier', 'weight'])
-            s_rec = analysis.higgs_125.merged_records(category, region,
+            b_rec = EventBatch.concatenate(
+                recs, fields=all_fields + ['classifier', 'weight'])
+            s_rec = analysis.higgs_125.merged_batch(category, region,
                 fields=all_fields, cuts=cuts,
                 include_weight=True,
                 clf=clf,
@@ -620,24 +832,24 @@ class Sample(object):
                     replace=False, p=prob)
                 return rec[sample_idx]
 
-            rec = stack([
+            rec = EventBatch.concatenate([
                 bootstrap(b_neg),
                 bootstrap(b_pos),
                 bootstrap(s_rec)],
                 fields=all_fields + ['classifier', 'weight'])
 
-            rec['weight'][:] = 1.
+            rec['weight'] = np.ones(len(rec))
             scores = rec['classifier']
         elif all_fields or scores is None:
             # TODO: only get unblinded vars
-            rec = self.merged_records(category, region,
+            rec = self.merged_batch(category, region,
                 fields=all_fields, cuts=cuts,
                 include_weight=True,
                 clf=classifier,
                 #scores=scores,
                 scores=scores[0] if isinstance(scores, tuple) else scores,
                 systematic=systematic)
-            if scores is None and 'classifier' in rec.dtype.names:
+            if scores is None and 'classifier' in rec:
                 scores = rec['classifier']
         else:
             # use scores only
@@ -645,8 +857,9 @@ class Sample(object):
                 weights = np.ones(len(scores))
             else:
                 scores, weights = scores
-            rec = np.core.records.fromarrays([scores, weights],
-                                             names=['classifier', 'weight'])
+            # the weights are modified below so copy them
+            rec = EventBatch([('classifier', scores),
+                              ('weight', np.array(weights, dtype='f8'))])
 
         if isinstance(scores, tuple):
             # sanity
@@ -655,24 +868,83 @@ class Sample(object):
             # weights
             scores = scores[0]
 
-        weights = rec['weight']
+        weights = rec[weight_field]
+        if shared_rec:
+            weights = weights.copy()
+        self.add_datainfo(field_hist)
+        return self.fill_batch(field_hist, rec, scores, weights,
+                               filler=filler, **fill_kwargs)
 
+    def add_datainfo(self, field_hist):
+        from .data import Data, DataInfo
+        if not isinstance(self, Data):
+            return
+        for hist in field_hist.values():
+            if hist is None:
+                continue
+            if hasattr(hist, 'datainfo'):
+                hist.datainfo += self.info
+            else:
+                hist.datainfo = DataInfo(self.info.lumi, self.info.energies)
+
+    def draw_chunks(self, field_hist, category, region,
+                    cuts=None,
+                    clf=None,
+                    systematic='NOMINAL',
+                    chunksize=100000,
+                    **fill_kwargs):
+        """
+        Fill the histograms in field_hist chunk by chunk. The classifier
+        scores are computed for each chunk.
+        """
+        all_fields, _ = self.draw_array_fields(field_hist)
+        fields = list(all_fields)
+        if clf is not None:
+            fields += [f for f in clf.fields if f not in fields]
+            if clf.partition_key is not None and \
+                    clf.partition_key not in fields:
+                fields.append(clf.partition_key)
+        for rec, idx in self.records(category, region,
+                                     fields=fields, cuts=cuts,
+                                     include_weight=True,
+                                     systematic=systematic,
+                                     return_idx=True,
+                                     as_batch=True,
+                                     chunksize=chunksize):
+            chunk_scores = None
+            if clf is not None:
+                rec['classifier'] = np.asarray(
+                    clf.score_batch(rec, idx), dtype='f4')
+                chunk_scores = rec['classifier']
+            # the weights of each chunk are not shared
+            self.fill_batch(field_hist, rec, chunk_scores, rec['weight'],
+                            **fill_kwargs)
+
+    def fill_batch(self, field_hist, rec, scores, weights,
+                   field_scale=None,
+                   weight_hist=None,
+                   field_weight_hist=None,
+                   min_score=None,
+                   max_score=None,
+                   scale=1.,
+                   filler=None):
+        """
+        Fill the histograms in field_hist with the events in rec. The weights
+        are modified in place.
+        """
+        # events passing the score cuts
+        selection = None
         if min_score is not None:
             if scores is None:
                 raise RuntimeError("min_score specified when scores is None")
             # cut below a minimum classifier score
-            idx = scores > min_score
-            rec = rec[idx]
-            weights = weights[idx]
-            scores = scores[idx]
+            selection = scores > min_score
         if max_score is not None:
             if scores is None:
                 raise RuntimeError("max_score specified when scores is None")
             # cut above a maximum classifier score
             idx = scores < max_score
-            rec = rec[idx]
-            weights = weights[idx]
-            scores = scores[idx]
+            selection = idx if selection is None else selection & idx
 
         def get_weight(array, hist):
             edges = np.array(list(hist.xedges()))
@@ -702,6 +974,11 @@ class Sample(object):
         if scale != 1.:
             weights *= scale
 
+        # the bin indices of each field are computed once and shared by all
+        # histograms (and systematics if the filler is shared) using them
+        fill = filler is None
+        if fill:
+            filler = HistFiller(rec, field_scale=field_scale)
         for fields, hist in field_hist.items():
             if isinstance(fields, Classifier) or fields is None:
                 fields = ['classifier']
@@ -711,36 +988,27 @@ class Sample(object):
             if hist is None:
                 # this var might be blinded
                 continue
-            # defensive copy
-            if isinstance(fields, tuple):
-                # select columns in numpy recarray with a list
-                fields = list(fields)
-            arr = np.copy(rec[fields])
-            if field_scale is not None:
-                for field in fields:
-                    if field in field_scale:
-                        arr[field] *= field_scale[field]
-            # convert to array
-            arr = rec2array(arr, fields=fields)
+            fields = list(fields)
             # include the scores if the histogram dimensionality allows
             if scores is not None and hist.GetDimension() == len(fields) + 1:
-                arr = np.c_[arr, scores]
+                fields.append(scores)
             elif hist.GetDimension() != len(fields):
                 raise TypeError(
                     'histogram dimensionality does not match '
                     'number of fields: %s' % (', '.join(fields)))
-            fill_hist(hist, arr, weights)
-            if isinstance(self, Data):
-                if hasattr(hist, 'datainfo'):
-                    hist.datainfo += self.info
-                else:
-                    hist.datainfo = DataInfo(self.info.lumi, self.info.energies)
-
-        if scores is not None and 'classifier' not in rec.dtype.names:
-            rec = recfunctions.rec_append_fields(rec,
-                names='classifier',
-                data=scores,
-                dtypes='f4')
+            filler.add(fields, hist, weights, selection=selection)
+        if fill:
+            filler.fill()
+
+        if selection is not None:
+            rec = rec[selection]
+            weights = weights[selection]
+            scores = scores[selection]
+
+        if scores is not None and 'classifier' not in rec:
+            # do not add the field to a shared batch
+            rec = rec.copy()
+            rec['classifier'] = np.asarray(scores, dtype='f4')
         return rec, weights
 
     def events(self, category=None, region=None,
@@ -779,9 +1047,10 @@ class Sample(object):
         rec = self.merged_records(category=category, region=region,
                                   cuts=cuts, systematic=systematic)
         if weighted:
+            weights = rec['weight']
             if scale != 1:
-                rec['weight'] *= scale
-            fill_hist(hist, np.ones(len(rec)), rec['weight'])
+                weights = weights * scale
+            fill_hist(hist, np.ones(len(rec)), weights)
         else:
             fill_hist(hist, np.ones(len(rec)))
         return hist
@@ -801,7 +1070,9 @@ class Sample(object):
             tree = rfile[treename]
             events = ds.events['NOMINAL']
             weight = LUMI[self.year] * scale * ds.xs * ds.kfact * ds.effic / events
-            selection =  (self.cuts(category, region) & cuts)
+            # the selection masks are not in the ROOT trees
+            selection = (self.cuts(category, region,
+                                   selection_masks=False) & cuts)
             if weighted:
                 weight_branches = self.weights()
                 selection *= Cut(str(weight * scale))
@@ -936,9 +1207,6 @@ class SystematicsSample(Sample):
         self.systematics = systematics
         self.tau_id_sf = tau_id_sf
         self.norms = {}
-        rfile = get_file(self.ntuple_path, self.student, force_reopen=self.force_reopen)
-        h5file = get_file(self.ntuple_path, self.student, hdf=True, force_reopen=self.force_reopen)
-
         from .ztautau import Embedded_Ztautau
 
         for i, name in enumerate(self.samples):
@@ -947,21 +1215,19 @@ class SystematicsSample(Sample):
             treename = name.replace('.', '_')
             treename = treename.replace('-', '_')
 
-            tables = {}
-            events = {}
-
             if isinstance(self, Embedded_Ztautau):
                 events_bin = 1
             else:
                 # use mc_weighted second bin
                 events_bin = 2
-            events_hist_suffix = '_cutflow'
 
-            tables['NOMINAL'] =  CachedTable.hook(getattr(
-                h5file.root, treename))
-            cutflow_hist = rfile[treename + events_hist_suffix]
-            events['NOMINAL'] = cutflow_hist[events_bin].value
-            del cutflow_hist
+            # tables and event counts are only read when first requested
+            tables = LazyMapping(self.get_table)
+            events = LazyMapping(
+                partial(self.get_events, events_bin=events_bin))
+
+            tables.add('NOMINAL', treename)
+            events.add('NOMINAL', treename)
 
             if self.systematics:
 
@@ -971,24 +1237,17 @@ class SystematicsSample(Sample):
                 if systematics_terms:
                     for sys_term in systematics_terms:
                         sys_name = treename + '_' + '_'.join(sys_term)
-                        tables[sys_term] = CachedTable.hook(getattr(
-                            h5file.root, sys_name))
-                        cutflow_hist = rfile[sys_name + events_hist_suffix]
-                        events[sys_term] = cutflow_hist[events_bin].value
-                        del cutflow_hist
+                        tables.add(sys_term, sys_name)
+                        events.add(sys_term, sys_name)
 
                 if systematics_samples:
                     for sample_name, sys_term in systematics_samples.items():
                         log.info("%s -> %s %s" % (name, sample_name, sys_term))
                         sys_term = tuple(sys_term.split(','))
-                        sys_ds = self.db[sample_name]
                         sample_name = sample_name.replace('.', '_')
                         sample_name = sample_name.replace('-', '_')
-                        tables[sys_term] = CachedTable.hook(getattr(
-                            h5file.root, sample_name))
-                        cutflow_hist = rfile[sample_name + events_hist_suffix]
-                        events[sys_term] = cutflow_hist[events_bin].value
-                        del cutflow_hist
+                        tables.add(sys_term, sample_name)
+                        events.add(sys_term, sample_name)
 
             if hasattr(self, 'xsec_kfact_effic'):
                 xs, kfact, effic = self.xsec_kfact_effic(i)
@@ -997,9 +1256,8 @@ class SystematicsSample(Sample):
             log.debug(
                 "dataset: {0}  cross section: {1} [pb] "
                 "k-factor: {2} "
-                "filtering efficiency: {3} "
-                "events {4}".format(
-                    ds.name, xs, kfact, effic, events['NOMINAL']))
+                "filtering efficiency: {3}".format(
+                    ds.name, xs, kfact, effic))
             dataset = Dataset(ds=ds, tables=tables, events=events,
                               xs=xs, kfact=kfact, effic=effic)
             self.datasets.append(dataset)
@@ -1026,26 +1284,79 @@ class SystematicsSample(Sample):
                    systematics=False,
                    systematics_components=None,
                    scale=1.,
-                   bootstrap_data=False):
-
+                   bootstrap_data=False,
+                   chunksize=None):
+        """
+        If chunksize is given then each systematic variation is read, scored
+        and filled in chunks of at most chunksize table rows
+        (see draw_array_helper). The weight-only systematics are then read
+        separately instead of from the NOMINAL read and (None, None) is
+        returned instead of the filled events.
+        """
         do_systematics = self.systematics and systematics
-        if scores is None and clf is not None:
+        if scores is None and clf is not None and chunksize is None:
             scores = self.scores(
                 clf, category, region, cuts=cuts,
                 systematics=systematics,
                 systematics_components=systematics_components)
 
+        nominal_scores = scores['NOMINAL'] if scores else None
+        weight_systematics = []
+        batch_rec = None
+        if do_systematics:
+            weight_systematics = self.weight_only_systematics(
+                systematics_components)
+        all_fields, classifier = self.draw_array_fields(field_hist)
+        if chunksize is not None:
+            # each chunk is only held while it is filled
+            if weight_systematics:
+                log.info("weight-only systematics of {0} are read "
+                         "separately when reading in chunks".format(
+                             self.name))
+            weight_systematics = []
+        elif weight_systematics and (all_fields or nominal_scores is None):
+            # read the NOMINAL selection once along with the weights of all
+            # weight-only systematics and fill all of them from that read
+            batch_rec = self.merged_batch(category, region,
+                fields=all_fields, cuts=cuts,
+                include_weight=True,
+                clf=classifier,
+                scores=(nominal_scores[0]
+                        if isinstance(nominal_scores, tuple)
+                        else nominal_scores),
+                weight_systematics=weight_systematics)
+        else:
+            # only scores are drawn and the scores of the weight-only
+            # systematics are already available
+            weight_systematics = []
+
+        filler = None
+        if batch_rec is not None:
+            # fill the nominal and all weight-only systematics in one pass
+            filler = HistFiller(batch_rec, field_scale=field_scale)
+
         rec, weights = self.draw_array_helper(field_hist, category, region,
             cuts=cuts,
             weighted=weighted,
             field_scale=field_scale,
             weight_hist=weight_hist,
             field_weight_hist=field_weight_hist,
-            scores=scores['NOMINAL'] if scores else None,
+            clf=clf,
+            scores=nominal_scores,
             min_score=min_score,
             max_score=max_score,
             systematic='NOMINAL',
-            scale=scale)
+            scale=scale,
+            rec=batch_rec,
+            filler=filler,
+            chunksize=chunksize)
+
+        if batch_rec is not None:
+            # drop the weights of the systematics
+            sys_weight_fields = [weight_systematics_field(sys)
+                                 for sys in weight_systematics]
+            rec = rec[[name for name in rec.names
+                       if name not in sys_weight_fields]]
 
         if not do_systematics:
             return rec, weights
@@ -1072,20 +1383,51 @@ class SystematicsSample(Sample):
                     all_sys_hists[field][systematic] = sys_hist
                 sys_field_hist[field] = sys_hist
 
+            if systematic in weight_systematics:
+                # fill from the NOMINAL read with the varied weights
+                self.draw_array_helper(sys_field_hist, category, region,
+                    cuts=cuts,
+                    weighted=weighted,
+                    field_scale=field_scale,
+                    weight_hist=weight_hist,
+                    field_weight_hist=field_weight_hist,
+                    scores=scores[systematic] if scores else None,
+                    min_score=min_score,
+                    max_score=max_score,
+                    systematic=systematic,
+                    scale=scale,
+                    rec=batch_rec,
+                    weight_field=weight_systematics_field(systematic),
+                    filler=filler)
+                continue
+
             self.draw_array_helper(sys_field_hist, category, region,
                 cuts=cuts,
                 weighted=weighted,
                 field_scale=field_scale,
                 weight_hist=weight_hist,
                 field_weight_hist=field_weight_hist,
+                clf=clf,
                 scores=scores[systematic] if scores else None,
                 min_score=min_score,
                 max_score=max_score,
                 systematic=systematic,
-                scale=scale)
+                scale=scale,
+                chunksize=chunksize)
+
+        if filler is not None:
+            filler.fill()
 
         return rec, weights
 
+    def weight_only_systematics(self, components=None):
+        """
+        Systematics only changing the event weights
+        """
+        return [systematic for systematic in iter_systematics(False,
+                    year=self.year, components=components)
+                if systematic in SYSTEMATICS_BY_WEIGHT]
+
     def scores(self, clf, category, region,
                cuts=None, scores_dict=None,
                systematics=False,
@@ -1096,24 +1438,67 @@ class SystematicsSample(Sample):
         do_systematics = self.systematics and systematics
         if scores_dict is None:
             scores_dict = {}
+        weight_systematics = []
+        if do_systematics:
+            weight_systematics = self.weight_only_systematics(
+                systematics_components)
+        # scores of each scoring key and weights of each weighting key
+        classified = {}
         for systematic in iter_systematics(True,
                 year=self.year,
                 components=systematics_components):
             if not do_systematics and systematic != 'NOMINAL':
                 continue
-            scores, weights = clf.classify(self,
-                category=category,
-                region=region,
-                cuts=cuts,
-                systematic=systematic)
-            weights *= scale
-            if systematic not in scores_dict:
-                scores_dict[systematic] = (scores, weights)
+            if systematic in weight_systematics:
+                # already classified with NOMINAL
+                continue
+            scoring_key = self.scoring_key(category, region, cuts, systematic)
+            weighting_key = self.weighting_key(systematic)
+            if scoring_key in classified:
+                # same events as a systematic already classified such as
+                # ZFIT, QCDFIT or variations without their own tables
+                scores, weights_by_key = classified[scoring_key]
+                if weighting_key in weights_by_key:
+                    weights = weights_by_key[weighting_key].copy()
+                else:
+                    log.info("reusing the scores for {0}".format(
+                        systematic_name(systematic)))
+                    weights = self.selected_weights(
+                        category, region, cuts, systematic)
+                    weights_by_key[weighting_key] = weights.copy()
+                results = [(systematic, scores, weights)]
+            elif systematic == 'NOMINAL' and weight_systematics:
+                # classify once and take the weights of all weight-only
+                # systematics from the same read
+                scores, weights, sys_weights = clf.classify(self,
+                    category=category,
+                    region=region,
+                    cuts=cuts,
+                    systematic=systematic,
+                    weight_systematics=weight_systematics)
+                classified[scoring_key] = (
+                    scores, {weighting_key: weights.copy()})
+                results = [(systematic, scores, weights)] + [
+                    (sys, scores, sys_weights[sys])
+                    for sys in weight_systematics]
             else:
-                prev_scores, prev_weights = scores_dict[systematic]
-                scores_dict[systematic] = (
-                    np.concatenate((prev_scores, scores)),
-                    np.concatenate((prev_weights, weights)))
+                scores, weights = clf.classify(self,
+                    category=category,
+                    region=region,
+                    cuts=cuts,
+                    systematic=systematic)
+                classified[scoring_key] = (
+                    scores, {weighting_key: weights.copy()})
+                results = [(systematic, scores, weights)]
+            for sys_term, scores, weights in results:
+                weights *= scale
+                if sys_term not in scores_dict:
+                    scores_dict[sys_term] = (scores, weights)
+                else:
+                    prev_scores, prev_weights = scores_dict[sys_term]
+                    scores_dict[sys_term] = (
+                        np.concatenate((prev_scores, scores)),
+                        np.concatenate((prev_weights, weights)))
         return scores_dict
 
     def records(self,
@@ -1125,14 +1510,54 @@ class SystematicsSample(Sample):
                 systematic='NOMINAL',
                 scale=1.,
                 return_idx=False,
+                weight_systematics=None,
+                as_batch=False,
+                chunksize=None,
                 **kwargs):
+        """
+        If weight_systematics is a list of weight-only systematics then a
+        weight_<systematic> field is added for each of them. The weights of
+        all variations are computed from the same read of the NOMINAL table.
 
-        from .ztautau import Ztautau
+        If as_batch is True then EventBatch objects are returned instead of
+        record arrays so the table reads are not copied.
+
+        If chunksize is given then a generator is returned instead of a list.
+        It walks the tables in windows of chunksize rows and yields the
+        selected events of each window so the memory used is set by the
+        chunk size and not by the size of the sample.
+        """
+        if weight_systematics is None:
+            weight_systematics = []
+        elif weight_systematics:
+            if not include_weight:
+                raise ValueError(
+                    "weight_systematics requires include_weight=True")
+            if systematic != 'NOMINAL':
+                raise ValueError(
+                    "weight_systematics can only be used with NOMINAL")
+            for sys in weight_systematics:
+                if sys not in SYSTEMATICS_BY_WEIGHT:
+                    raise ValueError(
+                        "{0} is not a weight-only systematic".format(
+                            systematic_name(sys)))
+        sys_weight_branches = [
+            (weight_systematics_field(sys), self.weights(sys))
+            for sys in weight_systematics]
         if include_weight and fields is not None:
             if 'weight' not in fields:
                 fields = list(fields) + ['weight']
+            fields = list(fields) + [
+                name for name, _ in sys_weight_branches]
         selection = self.cuts(category, region, systematic) & cuts
         table_selection = selection.where()
+        # the rows passing the parent selection are cached by the tables and
+        # only the refinement is evaluated for each category
+        parent, refinement = self.split_cuts(
+            category, region, systematic, cuts)
+        if parent is not None:
+            parent = parent.where()
+            refinement = refinement.where()
         if systematic == 'NOMINAL':
             log.info("requesting table from %s" %
                      (self.__class__.__name__))
@@ -1143,9 +1568,18 @@ class SystematicsSample(Sample):
         weight_branches = self.weights(systematic)
         if systematic in SYSTEMATICS_BY_WEIGHT:
             systematic = 'NOMINAL'
-        recs = []
-        if return_idx:
-            idxs = []
+        # only decode the columns that are actually needed
+        read_fields = None
+        if fields is not None:
+            read_fields = [f for f in fields if f != 'weight']
+            if include_weight:
+                read_fields += weight_branches + self.correction_fields()
+                for _, branches in sys_weight_branches:
+                    read_fields += branches
+            read_fields = tuple(unique_fields(read_fields))
+        # the tables are opened and the event counts are read here so that
+        # only the selections run in the read threads
+        reads = []
         for ds in self.datasets:
             try:
                 table = ds.tables[systematic]
@@ -1164,67 +1598,168 @@ class SystematicsSample(Sample):
                 "\nfiltering efficiency: {4}"
                 "\nevents {5}".format(
                     ds.name, table.name, ds.xs, ds.kfact, ds.effic, events))
-            actual_scale = self.scale
-            if isinstance(self, Ztautau):
-                if systematic == ('ZFIT_UP',):
-                    log.debug("scaling up for ZFIT_UP")
-                    actual_scale += self.scale_error
-                elif systematic == ('ZFIT_DOWN',):
-                    log.debug("scaling down for ZFIT_DOWN")
-                    actual_scale -= self.scale_error
+            actual_scale = self.systematic_scale(systematic)
             weight = (
                 scale * actual_scale *
                 LUMI[self.year] *
                 ds.xs * ds.kfact * ds.effic / events)
             if systematic in self.norms:
                 weight *= self.norms[systematic]
-            # read the table with a selection
-            try:
-                if table_selection:
-                    rec = table.read_where(table_selection, **kwargs)
-                else:
-                    rec = table.read(**kwargs)
-            except Exception as e:
-                print table
-                print e
-                continue
-                #raise
-            if return_idx:
-                # only valid if table_selection is non-empty
-                idx = table.get_where_list(table_selection, **kwargs)
-                idxs.append(idx)
+            reads.append((table, weight))
+
+        def make_batch(table, weight, rec, idx):
             # add weight field
             if include_weight:
-                weights = np.empty(rec.shape[0], dtype='f8')
-                weights.fill(weight)
-                # merge the weight fields
-                weights *= reduce(np.multiply,
-                    [rec[br] for br in weight_branches])
                 correction_weights = self.corrections(rec)
                 if correction_weights:
-                    weights *= reduce(np.multiply, correction_weights)
-                # drop other weight fields
-                #rec = recfunctions.rec_drop_fields(rec, weight_branches)
-                # add the combined weight
-                rec = recfunctions.rec_append_fields(rec,
-                    names='weight',
-                    data=weights,
-                    dtypes='f8')
-                if rec['weight'].shape[0] > 1 and rec['weight'].sum() == 0:
+                    correction_weights = reduce(
+                        np.multiply, correction_weights)
+                else:
+                    correction_weights = None
+
+                def combined_weight(branches):
+                    weights = np.empty(rec.shape[0], dtype='f8')
+                    weights.fill(weight)
+                    # merge the weight fields
+                    weights *= reduce(np.multiply,
+                        [rec[br] for br in branches])
+                    if correction_weights is not None:
+                        weights *= correction_weights
+                    return weights
+
+            batch = EventBatch.from_records(rec)
+            if include_weight:
+                # add the combined weights
+                batch['weight'] = combined_weight(weight_branches)
+                for name, branches in sys_weight_branches:
+                    batch[name] = combined_weight(branches)
+                if len(batch) > 1 and batch['weight'].sum() == 0:
                     log.warning("{0}: weights sum to zero!".format(table.name))
             if fields is not None:
                 try:
-                    rec = rec[fields]
+                    batch = batch[fields]
                 except Exception as e:
                     print table
                     print rec.shape
                     print rec.dtype
                     print e
                     raise
-            recs.append(rec)
+            if not as_batch:
+                batch = batch.to_records()
+            return batch, idx
+
+        if chunksize is not None:
+            return self.iter_chunks(reads, table_selection, read_fields,
+                                    chunksize, make_batch, return_idx)
+
+        def read(table_weight):
+            table, weight = table_weight
+            # read the table with a selection
+            try:
+                # the coordinates come from the same selection pass
+                if parent is not None:
+                    rec, idx = read_table(
+                        table, refinement, parent=parent,
+                        fields=read_fields, return_coords=True, **kwargs)
+                else:
+                    rec, idx = read_table(
+                        table, table_selection, fields=read_fields,
+                        return_coords=True, **kwargs)
+            except Exception as e:
+                print table
+                print e
+                return None
+                #raise
+            return make_batch(table, weight, rec, idx)
+
+        # the datasets may be read concurrently (see READ_WORKERS) but the
+        # results are kept in the order of the datasets
+        results = [res for res in map_reads(read, reads) if res is not None]
         if return_idx:
-            return zip(recs, idxs)
-        return recs
+            return results
+        return [batch for batch, _ in results]
+
+    def systematic_scale(self, systematic='NOMINAL'):
+        from .ztautau import Ztautau
+        scale = self.scale
+        if isinstance(self, Ztautau):
+            if systematic == ('ZFIT_UP',):
+                log.debug("scaling up for ZFIT_UP")
+                scale += self.scale_error
+            elif systematic == ('ZFIT_DOWN',):
+                log.debug("scaling down for ZFIT_DOWN")
+                scale -= self.scale_error
+        return scale
+
+    def scoring_key(self, category, region, cuts=None, systematic='NOMINAL'):
+        """
+        Identify the events classified for a systematic: the tables read and
+        the selection. Systematics with the same key have the same scores.
+        """
+        tables = tuple(
+            ds.tables.name(self.table_systematic(ds, systematic))
+            for ds in self.datasets)
+        selection = self.cuts(category, region, systematic) & cuts
+        return tables, selection.where()
+
+    def table_systematic(self, ds, systematic='NOMINAL'):
+        """
+        The systematic of the table of a dataset read for a systematic
+        """
+        if systematic in SYSTEMATICS_BY_WEIGHT:
+            return 'NOMINAL'
+        if systematic in ds.tables:
+            return systematic
+        return 'NOMINAL'
+
+    def score_tables(self, systematic='NOMINAL'):
+        return [ds.tables[self.table_systematic(ds, systematic)]
+                for ds in self.datasets]
+
+    def weighting_key(self, systematic='NOMINAL'):
+        """
+        Identify the weights of the events of a systematic. Systematics with
+        the same scoring and weighting keys have the same weights.
+        """
+        return (tuple(self.weights(systematic)),
+                self.systematic_scale(systematic),
+                # systematics normalized separately are not shared
+                systematic if systematic in self.norms else None)
+
+    def selected_weights(self, category, region, cuts=None,
+                         systematic='NOMINAL'):
+        """
+        Return only the weights of the selected events in the order of
+        records (and Classifier.classify)
+        """
+        recs = self.records(
+            category=category,
+            region=region,
+            fields=[],
+            cuts=cuts,
+            systematic=systematic,
+            as_batch=True)
+        if not recs:
+            return np.empty(0, dtype=np.float64)
+        return np.concatenate([
+            np.asarray(rec['weight'], dtype=np.float64) for rec in recs])
+
+    def iter_chunks(self, reads, condition, fields, chunksize,
+                    make_batch, return_idx=False):
+        """
+        Yield the weighted events of each (table, weight) in reads in chunks
+        of at most chunksize table rows
+        """
+        for table, weight in reads:
+            for rec, idx in table.iter_fields(
+                    condition, fields=fields, chunksize=chunksize):
+                if len(rec) == 0:
+                    continue
+                batch, idx = make_batch(table, weight, rec, idx)
+                if return_idx:
+                    yield batch, idx
+                else:
+                    yield batch
 
 
 class MC(SystematicsSample):
@@ -9,7 +9,7 @@ from root_numpy import rec2array, evaluate
 
 # local imports
 from . import log
-from .sample import SystematicsSample, Background, MC
+from .sample import SystematicsSample, Background, MC, LazyMapping
 from ..regions import REGIONS
 from .. import DAT_DIR
 
@@ -89,18 +89,26 @@ class Embedded_Ztautau(Ztautau, SystematicsSample):
             self.trigger_correct.SetDirectory(0)
         if self.systematics:
             # normalize ISOL and MFS variations to same as nominal
-            # at preselection
-            from ..categories import Category_Preselection
-            nps = [
-                ('MFS_UP',),
-                ('MFS_DOWN',),
-                ('ISOL_UP',),
-                ('ISOL_DOWN',)]
+            # at preselection when they are first used
+            self.norms = LazyMapping(self.preselection_norm)
+            for sys_term in [
+                    ('MFS_UP',),
+                    ('MFS_DOWN',),
+                    ('ISOL_UP',),
+                    ('ISOL_DOWN',)]:
+                self.norms.add(sys_term, sys_term)
+
+    def preselection_norm(self, systematic):
+        from ..categories import Category_Preselection
+        # the variations are not normalized while computing the norm
+        norms, self.norms = self.norms, {}
+        try:
             nominal_events = self.events(Category_Preselection)[1].value
-            for np in nps:
-                np_events = self.events(Category_Preselection,
-                                        systematic=np)[1].value
-                self.norms[np] =  nominal_events / np_events
+            np_events = self.events(Category_Preselection,
+                                    systematic=systematic)[1].value
+        finally:
+            self.norms = norms
+        return nominal_events / np_events
 
     def corrections(self, rec):
         # posterior trigger correction
@@ -110,6 +118,11 @@ class Embedded_Ztautau(Ztautau, SystematicsSample):
         weights = evaluate(self.trigger_correct, arr)
         return [weights]
 
+    def correction_fields(self):
+        if not self.posterior_trigger_correction:
+            return []
+        return ['tau1_pt', 'tau2_pt']
+
     def systematics_components(self):
         # No FAKERATE for embedding since fakes are data
         return super(Embedded_Ztautau, self).systematics_components() + [
@@ -0,0 +1,95 @@
+"""
+Persistent store of classifier scores
+
+The raw (untransformed) scores of a pair of trained classifiers are stored
+for each table as one column with an entry per table row. Rows that were
+never scored hold NaN. The columns are identified by the hash of the
+classifier pickles and by the table fingerprint (file size and modification
+time, see file_fingerprint) so scores are never reused after retraining or
+rebuilding the ntuple. Scripts that classify the same events only evaluate
+the BDTs the first time.
+
+Writes to a column are serialized across processes with a lock file next to
+the column. New scores are written in place so a write does not copy the
+whole column and readers see either NaN or the final score of a row.
+"""
+from tempfile import mkstemp
+import hashlib
+import fcntl
+import os
+
+import numpy as np
+
+from . import log; log = log[__name__]
+from . import CACHE_DIR
+
+SCORE_DIR = os.path.join(CACHE_DIR, 'scores')
+
+USE_SCORE_STORE = not os.getenv('NOSCORESTORE', None)
+if not USE_SCORE_STORE:
+    log.warning("score store is disabled")
+
+
+class ScoreStore(object):
+
+    def __init__(self, clf_hash):
+        self.path = os.path.join(SCORE_DIR, clf_hash)
+
+    def column_path(self, table):
+        key = repr(table.fingerprint())
+        return os.path.join(self.path, hashlib.sha1(key).hexdigest() + '.npy')
+
+    def get(self, table, idx):
+        """
+        Return the stored scores of the rows idx of a table or None if any
+        of these rows was not scored yet
+        """
+        path = self.column_path(table)
+        if not os.path.isfile(path):
+            return None
+        scores = np.load(path, mmap_mode='r')[idx]
+        if np.isnan(scores).any():
+            return None
+        return np.array(scores, dtype=np.float64)
+
+    def put(self, table, idx, scores):
+        """
+        Store the scores of the rows idx of a table
+        """
+        path = self.column_path(table)
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError:
+                # another process created it first
+                pass
+        with open(path + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                if os.path.isfile(path):
+                    column = np.load(path, mmap_mode='r+')
+                    column[idx] = scores
+                    column.flush()
+                    del column
+                    return
+                column = np.empty(table.nrows, dtype=np.float64)
+                column.fill(np.nan)
+                column[idx] = scores
+                # write to a temporary file and then rename it so that other
+                # processes never read a partially written column
+                fd, tmp_path = mkstemp(dir=self.path, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as tmp_file:
+                    np.save(tmp_file, column)
+                os.rename(tmp_path, path)
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def classifier_hash(pickles):
+    """
+    Hash of the pickled classifiers in the order they are applied
+    """
+    sha1 = hashlib.sha1()
+    for data in pickles:
+        sha1.update(hashlib.sha1(data).hexdigest())
+    return sha1.hexdigest()
@@ -0,0 +1,158 @@
+"""
+Precomputed selection bitmasks for the columnar ntuple store
+
+Every region, category, trigger and tau ID working point cut is evaluated
+once per table and the results are packed into integer columns
+selection_mask_0, selection_mask_1, ... with one bit per predicate. The
+predicates are listed in order in a manifest at the top of the store so a
+conjunction of covered cuts can be selected with a single bitwise test per
+mask column instead of evaluating the cuts again.
+"""
+import json
+import os
+
+import numpy as np
+from rootpy.tree import Cut
+
+from . import log; log = log[__name__]
+from .cachedtable import normalize_condition
+from .cutcompiler import compile_cut
+from .columnstore import ColumnTable, write_column, MANIFEST as TABLE_MANIFEST
+
+MANIFEST = 'selection_masks.json'
+# keep the sign bit clear so the masks are valid int64 in numexpr and ROOT
+WORD_BITS = 63
+MASK_FIELD = 'selection_mask_{0:d}'
+
+
+def cut_key(cut):
+    if isinstance(cut, basestring):
+        return normalize_condition(cut)
+    return normalize_condition(cut.where()) if cut else ''
+
+
+def analysis_predicates(years=(2011, 2012)):
+    """
+    All cuts that are precomputed: the trigger, the tau ID working points,
+    all REGIONS and the cuts of all registered categories in each year
+    """
+    # importing the categories registers all of them
+    from .categories import common
+    from .categories.base import CategoryMeta
+    from .regions import REGIONS
+    cuts = [
+        Cut('trigger'),
+        common.TAU1_MEDIUM, common.TAU2_MEDIUM,
+        common.TAU1_TIGHT, common.TAU2_TIGHT,
+        common.ID_MEDIUM, common.ID_TIGHT,
+        common.ID_MEDIUM_TIGHT, common.ID_MEDIUM_NOT_TIGHT,
+    ]
+    cuts.extend(REGIONS[name] for name in sorted(REGIONS.keys()))
+    registry = CategoryMeta.CATEGORY_REGISTRY
+    for name in sorted(registry.keys()):
+        for year in years:
+            cuts.append(registry[name].get_cuts(year))
+    predicates = []
+    keys = set()
+    for cut in cuts:
+        key = cut_key(cut)
+        if not key or key in keys:
+            continue
+        keys.add(key)
+        predicates.append(cut.where())
+    return predicates
+
+
+class SelectionMasks(object):
+    """
+    Bit assignment of the precomputed predicates
+    """
+    def __init__(self, predicates):
+        self.predicates = list(predicates)
+        self.bits = dict((cut_key(predicate), bit)
+                         for bit, predicate in enumerate(self.predicates))
+
+    @classmethod
+    def load(cls, store):
+        with open(os.path.join(store, MANIFEST)) as f:
+            manifest = json.load(f)
+        return cls(manifest['predicates'])
+
+    def save(self, store):
+        with open(os.path.join(store, MANIFEST), 'w') as f:
+            json.dump({'predicates': self.predicates}, f, indent=2)
+
+    @property
+    def fields(self):
+        return [MASK_FIELD.format(word) for word in
+                xrange((len(self.predicates) + WORD_BITS - 1) // WORD_BITS)]
+
+    def bit(self, cut):
+        """
+        Return the bit of a cut or None if the cut is not precomputed
+        """
+        return self.bits.get(cut_key(cut), None)
+
+    def select(self, cuts):
+        """
+        Return the conjunction of cuts using a single bitwise test per mask
+        column for all precomputed cuts
+        """
+        words = {}
+        selection = Cut()
+        for cut in cuts:
+            if not cut:
+                continue
+            bit = self.bit(cut)
+            if bit is None:
+                selection &= cut
+                continue
+            word, bit = divmod(bit, WORD_BITS)
+            words[word] = words.get(word, 0) | (1 << bit)
+        for word in sorted(words.keys()):
+            selection &= Cut('({0} & {1:d}) == {1:d}'.format(
+                MASK_FIELD.format(word), words[word]))
+        return selection
+
+    def evaluate(self, table):
+        """
+        Return the mask columns of a ColumnTable
+        """
+        evaluator = table.evaluator()
+        words = [np.zeros(table.nrows, dtype=np.int64) for _ in self.fields]
+        for bit, predicate in enumerate(self.predicates):
+            word, bit = divmod(bit, WORD_BITS)
+            words[word] |= evaluator(predicate).astype(np.int64) << bit
+        return words
+
+
+def write_selection_masks(store, predicates=None):
+    """
+    Evaluate the predicates on all tables in a columnar store and write the
+    mask columns. Predicates referring to columns missing in any table are
+    not precomputed.
+    """
+    if predicates is None:
+        predicates = analysis_predicates()
+    tables = [ColumnTable(os.path.join(store, name))
+              for name in sorted(os.listdir(store))
+              if os.path.isfile(os.path.join(store, name, TABLE_MANIFEST))]
+    covered = []
+    for predicate in predicates:
+        fields = compile_cut(predicate).fields
+        missing = [table.name for table in tables
+                   if not fields.issubset(table.coldtypes)]
+        if missing:
+            log.warning("not precomputing {0}: missing columns in {1}".format(
+                predicate, ', '.join(missing)))
+            continue
+        covered.append(predicate)
+    masks = SelectionMasks(covered)
+    log.info("precomputing {0:d} predicates in {1:d} mask columns".format(
+        len(masks.predicates), len(masks.fields)))
+    for table in tables:
+        log.info("writing selection masks of {0} ...".format(table.name))
+        for field, column in zip(masks.fields, masks.evaluate(table)):
+            write_column(table.path, field, column)
+    masks.save(store)
+    return masks
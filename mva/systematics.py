@@ -131,6 +131,13 @@ def systematic_name(systematic):
     return '_'.join(systematic)
 
 
+def weight_systematics_field(systematic):
+    """
+    Name of the weight field of a weight-only systematic variation
+    """
+    return 'weight_' + systematic_name(systematic)
+
+
 def parse_systematics(string):
     if not string:
         return None
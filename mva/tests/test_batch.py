@@ -0,0 +1,53 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from mva.batch import EventBatch
+from nose.tools import assert_equal, assert_raises, assert_true
+
+REC = np.core.records.fromarrays(
+    [np.arange(10, dtype='f8'),
+     np.arange(10, dtype='i4') % 3,
+     np.ones(10, dtype='f4')],
+    names='x,y,weight')
+
+
+def test_from_records():
+    batch = EventBatch.from_records(REC)
+    assert_equal(len(batch), 10)
+    assert_equal(batch.names, ['x', 'y', 'weight'])
+    # fields are views of the records
+    assert_true(batch['x'].base is not None)
+    assert_array_equal(batch.to_records(), REC)
+
+
+def test_fields():
+    batch = EventBatch.from_records(REC)
+    batch['z'] = batch['x'] * 2
+    sub = batch[['z', 'y']]
+    assert_equal(sub.names, ['z', 'y'])
+    assert_true(sub['y'] is batch['y'])
+    assert_raises(ValueError, batch.__setitem__, 'bad', np.ones(3))
+    assert_raises(ValueError, batch.column, 'missing')
+    del batch['z']
+    assert_true('z' not in batch)
+
+
+def test_select_and_concatenate():
+    batch = EventBatch.from_records(REC)
+    mask = REC['y'] == 1
+    selected = batch[mask]
+    assert_equal(len(selected), mask.sum())
+    assert_array_equal(selected['x'], REC['x'][mask])
+    assert_array_equal(batch[2:5]['x'], REC['x'][2:5])
+    merged = EventBatch.concatenate([batch, selected], ['x', 'weight'])
+    assert_equal(len(merged), 10 + mask.sum())
+    assert_array_equal(merged['x'],
+                       np.concatenate([REC['x'], REC['x'][mask]]))
+    arr = merged.to_array(['x', 'weight'])
+    assert_equal(arr.shape, (len(merged), 2))
+    assert_array_equal(arr[:, 0], merged['x'])
+    assert_equal(len(EventBatch.concatenate([])), 0)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -0,0 +1,49 @@
+import numpy as np
+from numpy.testing import assert_almost_equal, assert_array_equal
+from nose.tools import assert_equal, assert_true
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.tree import DecisionTreeClassifier
+from mva.bdtcompiler import CompiledBDT, tree_depth
+
+np.random.seed(0)
+X = np.concatenate([np.random.normal(0, 1, (500, 4)),
+                    np.random.normal(0.5, 1, (500, 4))])
+y = np.concatenate([np.zeros(500), np.ones(500)])
+w = np.random.uniform(0.5, 1.5, 1000)
+
+
+def check_decision_function(algorithm, tree):
+    clf = AdaBoostClassifier(
+        tree,
+        n_estimators=20,
+        learning_rate=0.1,
+        algorithm=algorithm,
+        random_state=0)
+    clf.fit(X, y, sample_weight=w)
+    compiled = CompiledBDT(clf, batch_size=128)
+    assert_almost_equal(compiled.decision_function(X),
+                        clf.decision_function(X))
+    leaves = compiled.apply(X[:10])
+    assert_array_equal(leaves.shape, (10, len(clf.estimators_)))
+
+
+def test_decision_function():
+    for algorithm in ('SAMME.R', 'SAMME'):
+        yield check_decision_function, algorithm, \
+            DecisionTreeClassifier(max_depth=4)
+        # unbounded trees as built by Classifier.train
+        yield check_decision_function, algorithm, \
+            DecisionTreeClassifier(min_fraction_leaf=0.01)
+
+
+def test_tree_depth():
+    tree = DecisionTreeClassifier(max_depth=3).fit(X, y, sample_weight=w)
+    assert_equal(tree_depth(tree.tree_), 3)
+    tree = DecisionTreeClassifier(min_fraction_leaf=0.01).fit(
+        X, y, sample_weight=w)
+    assert_true(3 < tree_depth(tree.tree_) < 100)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
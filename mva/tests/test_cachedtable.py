@@ -0,0 +1,77 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from mva.cachedtable import TableCache, read_refined
+from mva.cutcompiler import evaluate
+from nose.tools import assert_equal, assert_raises
+
+
+def test_lru_eviction():
+    arr = np.zeros(10, dtype='f8')
+    cache = TableCache(max_bytes=2 * arr.nbytes)
+    cache['a'] = arr
+    cache['b'] = arr.copy()
+    # touch a so that b is the least recently used
+    cache['a']
+    cache['c'] = arr.copy()
+    assert_raises(KeyError, cache.__getitem__, 'b')
+    cache['a']
+    cache['c']
+    stats = cache.stats()
+    assert_equal(stats['hits'], 3)
+    assert_equal(stats['misses'], 1)
+    assert_equal(stats['evictions'], 1)
+    assert_equal(stats['entries'], 2)
+    assert_equal(stats['bytes'], 2 * arr.nbytes)
+
+
+def test_oversized():
+    cache = TableCache(max_bytes=8)
+    cache['a'] = np.zeros(10, dtype='f8')
+    assert_equal(len(cache), 0)
+    assert_equal(cache.stats()['bytes'], 0)
+
+
+def test_shrink():
+    arr = np.zeros(10, dtype='f8')
+    cache = TableCache(max_bytes=3 * arr.nbytes)
+    for key in 'abc':
+        cache[key] = (arr.copy(), arr.copy()[:5])
+    cache.set_max_bytes(2 * arr.nbytes)
+    assert_equal(len(cache), 1)
+    assert_equal(cache.stats()['evictions'], 2)
+
+
+class ArrayTable(object):
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.colnames = sorted(columns.keys())
+        self.coldtypes = dict(
+            (name, col.dtype) for name, col in columns.items())
+
+    def selected_coordinates(self, condition, start, stop, step):
+        return np.flatnonzero(evaluate(condition, self.columns))
+
+    def selected_column(self, condition, name, start, stop, step):
+        return self.columns[name][
+            self.selected_coordinates(condition, start, stop, step)]
+
+
+def test_read_refined():
+    columns = {
+        'a': np.arange(20),
+        'b': np.arange(20) % 3,
+    }
+    table = ArrayTable(columns)
+    rec, coords = read_refined(table, 'a > 4', 'b == 1',
+                               fields=['a'], return_coords=True)
+    expected = np.flatnonzero(evaluate('(a > 4) & (b == 1)', columns))
+    assert_array_equal(coords, expected)
+    assert_array_equal(rec['a'], columns['a'][expected])
+    rec = read_refined(table, 'a > 4', fields=['b'])
+    assert_array_equal(rec['b'], columns['b'][columns['a'] > 4])
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
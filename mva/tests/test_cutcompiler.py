@@ -0,0 +1,65 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from mva.cutcompiler import compile_cut, CutEvaluator
+from nose.tools import assert_equal, assert_true, assert_raises
+
+COLUMNS = {
+    'a': np.array([1, 2, 3, 4, 5, 6]),
+    'b': np.array([-1., 1., -1., 1., -1., 1.]),
+    'c': np.array([True, False, True, True, False, False]),
+}
+
+
+def test_expressions():
+    a, b, c = COLUMNS['a'], COLUMNS['b'], COLUMNS['c']
+    for expression, expected in [
+            ('a > 2', a > 2),
+            ('(a > 2) & c', (a > 2) & c),
+            ('(a > 2) | ~c', (a > 2) | ~c),
+            ('1 < a <= 4', (1 < a) & (a <= 4)),
+            ('abs(b * a) > 3', np.abs(b * a) > 3),
+            ('(a % 2) == 0', (a % 2) == 0),
+            ('(a * b) == -1', (a * b) == -1),
+            ('c', c),
+            ]:
+        yield assert_array_equal, compile_cut(expression)(COLUMNS), expected
+
+
+def test_fields():
+    cut = compile_cut('(a > 2) & (abs(b) < 1) | c')
+    assert_equal(cut.fields, frozenset(['a', 'b', 'c']))
+
+
+def test_compile_once():
+    assert_true(compile_cut('a > 2') is compile_cut(' a > 2 '))
+
+
+def test_empty():
+    mask = CutEvaluator(COLUMNS, size=6)('')
+    assert_equal(mask.sum(), 6)
+    assert_raises(ValueError, CutEvaluator(COLUMNS), '')
+
+
+def test_shared_masks():
+    evaluator = CutEvaluator(COLUMNS)
+    evaluator('(a > 2) & c')
+    nmasks = len(evaluator.masks)
+    # only the new comparison and the conjunction are computed
+    mask = evaluator('((a > 2) & c) & (b > 0)')
+    assert_equal(len(evaluator.masks), nmasks + 2)
+    assert_array_equal(mask, np.array([False, False, False, True, False, False]))
+
+
+def test_only_masks_kept():
+    evaluator = CutEvaluator(COLUMNS)
+    evaluator('(abs(b * a) > 3) & ((a & 1) == 1)')
+    # the two comparisons and the conjunction but not the products or the
+    # bitwise operation on integers
+    assert_equal(len(evaluator.masks), 3)
+    for mask in evaluator.masks.values():
+        assert_equal(mask.dtype, np.bool_)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
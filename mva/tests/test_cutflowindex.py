@@ -0,0 +1,30 @@
+import os
+import shutil
+from tempfile import mkdtemp
+from mva.cutflowindex import CutflowIndex, write_index
+from nose.tools import assert_equal, assert_false, assert_true
+
+
+def test_index():
+    tmpdir = mkdtemp()
+    try:
+        source = os.path.join(tmpdir, 'hhskim.root')
+        with open(source, 'w') as f:
+            f.write('ntuple')
+        path = os.path.join(tmpdir, 'hhskim.cutflow.json')
+        write_index(path, {'ggH125': [0., 100., 95.5, 40.]}, source=source)
+        index = CutflowIndex.load(path)
+        assert_equal(index.get('ggH125', 2), 95.5)
+        assert_equal(index.get('ggH125', 10), None)
+        assert_equal(index.get('VBFH125', 2), None)
+        assert_false(index.is_stale(source))
+        with open(source, 'a') as f:
+            f.write(' rebuilt')
+        assert_true(index.is_stale(source))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
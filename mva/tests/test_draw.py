@@ -35,3 +35,26 @@ def test_draw():
             print term
             sys_hist_array = hist_array.systematics[term]
             assert_almost_equal(sys_hist.Integral(), sys_hist_array.Integral())
+
+
+def test_draw_chunks_clf():
+
+    clf = analysis.get_clf(Category_VBF, mass=125, load=True)
+    for sample in analysis.backgrounds + [analysis.data]:
+        print sample.name
+
+        hist = Hist(1, -1000, 1000)
+        hist_chunks = hist.Clone()
+
+        # an explicit classifier is applied for the score cuts
+        sample.draw_array({'tau1_charge': hist}, Category_VBF, 'OS_TRK',
+                          clf=clf, min_score=-0.5, max_score=0.5,
+                          systematics=False)
+        sample.draw_array({'tau1_charge': hist_chunks},
+                          Category_VBF, 'OS_TRK',
+                          clf=clf, min_score=-0.5, max_score=0.5,
+                          systematics=False,
+                          chunksize=1000)
+
+        assert_almost_equal(hist.Integral(), hist_chunks.Integral(),
+                            places=3)
@@ -0,0 +1,72 @@
+import os
+import pickle
+import numpy as np
+import scipy.sparse as sp
+from numpy.testing import assert_array_equal
+from sklearn.ensemble import AdaBoostClassifier
+from sklearn.tree import DecisionTreeClassifier
+from sklearn.metrics import roc_auc_score
+from mva.grid_search import SharedArrays, BoostHalvingSearchCV
+from nose.tools import assert_equal, assert_true, assert_false
+
+
+def test_shared_arrays():
+    X = np.random.normal(size=(1000, 5))
+    y = np.random.randint(0, 2, 1000)
+    data = SharedArrays(X, y)
+    try:
+        # only the file names are pickled
+        dumped = pickle.dumps(data)
+        assert_true(len(dumped) < X.nbytes / 10)
+        shared_X, shared_y, shared_w = pickle.loads(dumped).open()
+        assert_array_equal(shared_X, X)
+        assert_array_equal(shared_y, y)
+        assert_equal(shared_w, None)
+    finally:
+        data.close()
+    assert_false(os.path.exists(data.folder))
+
+
+def test_shared_sparse():
+    X = sp.csr_matrix(np.eye(10))
+    data = SharedArrays(X, np.arange(10))
+    try:
+        shared_X, shared_y, _ = pickle.loads(pickle.dumps(data)).open()
+        assert_true(sp.issparse(shared_X))
+        assert_array_equal(shared_X.toarray(), np.eye(10))
+        assert_array_equal(shared_y, np.arange(10))
+    finally:
+        data.close()
+
+
+def test_halving_search():
+    np.random.seed(0)
+    X = np.concatenate([np.random.normal(0, 1, (200, 3)),
+                        np.random.normal(0.5, 1, (200, 3))])
+    y = np.concatenate([np.zeros(200), np.ones(200)])
+    depths = range(1, 7)
+    search = BoostHalvingSearchCV(
+        AdaBoostClassifier(DecisionTreeClassifier(), random_state=0),
+        {'base_estimator__max_depth': depths},
+        max_n_estimators=9,
+        factor=2,
+        score_func=roc_auc_score,
+        cv=4,
+        n_jobs=1)
+    search.fit(X, y)
+    # same layout as BoostGridSearchCV: all depths for all numbers of trees
+    assert_equal(len(search.grid_scores_), len(depths) * 9)
+    points = set((params['base_estimator__max_depth'],
+                  params['n_estimators'])
+                 for params, _, _ in search.grid_scores_)
+    assert_equal(len(points), len(depths) * 9)
+    assert_true(search.best_params_['base_estimator__max_depth'] in depths)
+    # the best candidate is evaluated on all folds
+    best = [score for score in search.grid_scores_
+            if score.parameters == search.best_params_][0]
+    assert_equal(len(best.cv_validation_scores), 4)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
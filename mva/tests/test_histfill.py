@@ -0,0 +1,53 @@
+import numpy as np
+from numpy.testing import assert_almost_equal
+from rootpy.plotting import Hist, Hist2D
+from root_numpy import fill_hist, rec2array
+from mva.histfill import HistFiller, find_bins
+from nose.tools import assert_equal
+
+np.random.seed(0)
+REC = np.core.records.fromarrays(
+    [np.random.normal(0.5, 0.5, 1000),
+     np.random.uniform(-1, 2, 1000),
+     np.random.exponential(size=1000)],
+    names='x,y,w')
+
+
+def check_hist(hist, expected):
+    cells = range(hist.GetSize())
+    assert_almost_equal([hist.GetBinContent(i) for i in cells],
+                        [expected.GetBinContent(i) for i in cells])
+    assert_almost_equal([hist.GetBinError(i) for i in cells],
+                        [expected.GetBinError(i) for i in cells])
+    assert_equal(hist.GetEntries(), expected.GetEntries())
+    assert_almost_equal(hist.GetMean(), expected.GetMean())
+
+
+def test_find_bins():
+    edges = (0., 1., 2.)
+    assert_equal(list(find_bins([-1., 0., 0.5, 1., 2., 3.], edges)),
+                 [0, 1, 1, 2, 3, 3])
+
+
+def test_fill():
+    selection = REC['y'] > 0
+    hists = [Hist(10, 0, 1), Hist(10, 0, 1), Hist2D(5, 0, 1, 6, -1, 2)]
+    filler = HistFiller(REC)
+    filler.add(['x'], hists[0], REC['w'])
+    filler.add(['x'], hists[1], REC['w'] * 2, selection=selection)
+    filler.add(['x', 'y'], hists[2], REC['w'])
+    filler.fill()
+
+    expected = [h.Clone() for h in hists]
+    for h in expected:
+        h.Reset()
+    fill_hist(expected[0], REC['x'], REC['w'])
+    fill_hist(expected[1], REC['x'][selection], REC['w'][selection] * 2)
+    fill_hist(expected[2], rec2array(REC, ['x', 'y']), REC['w'])
+    for hist, exp in zip(hists, expected):
+        yield check_hist, hist, exp
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
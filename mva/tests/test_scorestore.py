@@ -0,0 +1,46 @@
+import os
+import shutil
+from tempfile import mkdtemp
+import numpy as np
+from numpy.testing import assert_array_equal
+from mva.scorestore import ScoreStore, classifier_hash
+from nose.tools import assert_equal, assert_not_equal
+
+
+class FakeTable(object):
+
+    def __init__(self, nrows, version):
+        self.nrows = nrows
+        self.version = version
+
+    def fingerprint(self):
+        return ('hhskim.h5', self.version), '/ggH125'
+
+
+def test_store():
+    tmpdir = mkdtemp()
+    try:
+        store = ScoreStore(classifier_hash(['clf0', 'clf1']))
+        store.path = os.path.join(tmpdir, 'scores')
+        table = FakeTable(10, 1)
+        assert_equal(store.get(table, [1, 3]), None)
+        store.put(table, [1, 3], [0.5, -0.25])
+        assert_array_equal(store.get(table, [3, 1]), [-0.25, 0.5])
+        # rows not scored yet
+        assert_equal(store.get(table, [1, 2]), None)
+        store.put(table, [2], [0.125])
+        assert_array_equal(store.get(table, [1, 2]), [0.5, 0.125])
+        # the rebuilt table is not scored yet
+        assert_equal(store.get(FakeTable(10, 2), [1]), None)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_classifier_hash():
+    assert_not_equal(classifier_hash(['clf0', 'clf1']),
+                     classifier_hash(['clf1', 'clf0']))
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()
@@ -0,0 +1,42 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+from rootpy.tree import Cut
+from mva.cutcompiler import CutEvaluator, evaluate
+from mva.selectionmasks import SelectionMasks, MASK_FIELD
+from nose.tools import assert_equal, assert_true
+
+
+class Table(object):
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.nrows = len(columns.values()[0])
+
+    def evaluator(self):
+        return CutEvaluator(self.columns)
+
+
+def test_select():
+    columns = {
+        'a': np.arange(10),
+        'b': np.arange(10) % 3,
+        'c': np.arange(10) % 2 == 0,
+    }
+    predicates = [Cut('a > 2'), Cut('b == 1') & Cut('c'), Cut('a < 8')]
+    masks = SelectionMasks([cut.where() for cut in predicates])
+    table = Table(columns)
+    mask_columns = dict(columns)
+    for field, column in zip(masks.fields, masks.evaluate(table)):
+        mask_columns[field] = column
+    extra = Cut('b != 2')
+    selection = masks.select(predicates + [extra])
+    assert_true(MASK_FIELD.format(0) in selection.where())
+    assert_equal(masks.bit(extra), None)
+    expected = evaluate(
+        reduce(lambda a, b: a & b, predicates + [extra]), columns)
+    assert_array_equal(evaluate(selection, mask_columns), expected)
+
+
+if __name__ == "__main__":
+    import nose
+    nose.runmodule()